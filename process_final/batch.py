@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Batch corpus mode
+=================
+Runs a whole directory (or manifest) of books through the pipeline in one
+process, so the LLM and the embedder are loaded once for the corpus.
+
+Chunks from every book share a single ``imap_ordered`` work queue: while one
+book is being geocoded, classified and written on a background thread, the
+next book's chunks are already in flight, so the LLM never drains at book
+boundaries.
+
+  python batch.py ../literature_data/ --out-dir ../geojson_output/
+  python batch.py books.json --combined corpus.ndjson --prefilter
+
+A manifest is a JSON list of paths or {"input", "source", "out"} objects, or
+a text file with one path per line (optionally ``path<TAB>source``).  Relative
+paths are resolved against the manifest's directory.
+
+Writes one output per book (plus its journal and score sidecar), a combined
+collection of every book, and ``batch_report.json`` with per-book throughput
+and the run metrics (see metrics.py).
+"""
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pipeline
+from chunking import drop_repeats
+from geojson_stream import FeatureWriter
+from ingest import MARKUP_SUFFIXES
+from journal import ExtractionJournal, journal_path_for
+from llm import imap_ordered
+from metrics import metrics
+from regions import region_filter
+from rethreshold import scores_path_for
+
+INPUT_SUFFIXES = {".txt"} | MARKUP_SUFFIXES
+
+
+class Book:
+    def __init__(self, input_path: Path, source: str, out: Path):
+        self.input    = input_path
+        self.source   = source
+        self.out      = out
+        self.journal  = None
+        self.counts   = pipeline.new_counts()
+        self.raw: list[dict]  = []
+        self.prev: list[dict] = []
+        self.done     = 0
+        self.features = 0
+        self.error    = ""
+        self.t_start = self.t_extracted = self.t_done = 0.0
+
+    def report(self) -> dict:
+        extract = max(self.t_extracted - self.t_start, 1e-9)
+        return {
+            "source":          self.source,
+            "input":           str(self.input),
+            "out":             str(self.out),
+            "chunks":          self.counts["chunks"],
+            "llm_calls":       self.counts["new"],
+            "skipped":         self.counts["skipped"],
+            "failed_chunks":   self.counts["failed"],
+            "mentions":        len(self.raw),
+            "features":        self.features,
+            "extract_seconds": round(extract, 2),
+            "total_seconds":   round(self.t_done - self.t_start, 2),
+            "chunks_per_sec":  round(self.counts["chunks"] / extract, 2),
+            "error":           self.error,
+        }
+
+# =============================================================================
+# DISCOVERY
+# =============================================================================
+
+def discover(path: Path, out_dir: Path | None = None, fmt: str | None = None) -> list[Book]:
+    """Books in a directory (by suffix) or listed in a manifest file."""
+    entries: list[dict] = []
+    if path.is_dir():
+        entries = [{"input": p} for p in sorted(path.iterdir())
+                   if p.suffix.lower() in INPUT_SUFFIXES]
+        base = path
+    else:
+        base = path.parent
+        if path.suffix.lower() == ".json":
+            for item in json.loads(path.read_text(encoding="utf-8")):
+                entries.append(item if isinstance(item, dict) else {"input": item})
+        else:
+            for line in path.read_text(encoding="utf-8").splitlines():
+                if line.strip() and not line.lstrip().startswith("#"):
+                    name, _, source = line.partition("\t")
+                    entries.append({"input": name.strip(), "source": source.strip()})
+
+    suffix = ".ndjson" if fmt == "ndjson" else ".geojson"
+    books = []
+    for entry in entries:
+        input_path = Path(entry["input"])
+        if not input_path.is_absolute():
+            input_path = base / input_path
+        if entry.get("out"):
+            out = Path(entry["out"])
+            if not out.is_absolute():
+                out = base / out
+        else:
+            out = (out_dir or input_path.parent) / (input_path.stem + suffix)
+        books.append(Book(input_path, entry.get("source") or input_path.stem, out))
+    return books
+
+# =============================================================================
+# RUN
+# =============================================================================
+
+def _finish(book: Book, fmt: str | None, combined: FeatureWriter | None) -> None:
+    """Geocode, classify and write one fully extracted book (background thread)."""
+    print(f"\n  ── {book.source}: {len(book.raw)} mention(s) extracted", flush=True)
+    try:
+        with FeatureWriter(book.out, fmt) as writer:
+            for feature in pipeline.locate_and_classify(book.raw, book.source,
+                                                        scores_path_for(book.out)):
+                writer.write(feature)
+                if combined is not None:
+                    combined.write(feature)
+        book.features = writer.count
+        print(f"  ✓ {book.source}: {book.features} feature(s) → {book.out}", flush=True)
+    except Exception as e:
+        book.error = f"{type(e).__name__}: {e}"
+        print(f"  ✗ {book.source}: {book.error}", flush=True)
+    book.t_done = time.perf_counter()
+
+
+def run_batch(books: list[Book], fmt: str | None = None, combined_path: Path | None = None,
+              resume: bool = False, use_prefilter: bool = pipeline.PREFILTER) -> list[dict]:
+    """Process ``books`` through one shared LLM queue; return per-book reports."""
+    pipeline.get_geocoder()   # fail before any extraction if the geocoder is unusable
+    region_filter()           # … or REGION_FILTER names an unknown region
+    fingerprint = pipeline.extraction_fingerprint()
+    combined = FeatureWriter(combined_path) if combined_path else None
+    post     = ThreadPoolExecutor(max_workers=1)   # one book's post-processing at a time
+
+    def _tasks():
+        for book in books:
+            book.t_start = time.perf_counter()
+            try:
+                book.journal = ExtractionJournal(journal_path_for(book.out), fingerprint,
+                                                 resume)
+                for task in pipeline.chunk_tasks(book.input, book.journal, use_prefilter,
+                                                 book.counts):
+                    yield book, task
+            except Exception as e:   # e.g. unreadable book — skip it, keep the batch going
+                book.error = f"{type(e).__name__}: {e}"
+                print(f"  ✗ {book.source}: {book.error}", flush=True)
+            yield book, None   # end-of-book marker
+
+    def _run(item):
+        book, task = item
+        return None if task is None else pipeline.extract_task(task)
+
+    t0 = time.perf_counter()
+    try:
+        for (book, task), result in imap_ordered(_run, _tasks(),
+                                                 pipeline.get_llm().max_in_flight):
+            if task is None:
+                book.t_extracted = time.perf_counter()
+                if book.journal is not None:
+                    book.journal.close()
+                if book.error:
+                    book.t_done = book.t_extracted
+                    continue
+                pipeline.report_extraction(book.counts, book.journal, use_prefilter)
+                post.submit(_finish, book, fmt, combined)
+                continue
+            found, fresh = result
+            meta = task[2]
+            book.done += 1
+            if found is None:
+                book.counts["failed"] += 1
+                print(f"  ⚠  {book.source} chunk {book.done}: LLM request failed ({fresh})"
+                      " — left for --resume", flush=True)
+                continue
+            if fresh:
+                book.counts["new"] += 1
+                book.journal.record(task[0], found)
+                print(f"  [LLM] {book.source} chunk {book.done} "
+                      f"→ {len(found)} found", flush=True)
+            if pipeline.CHUNK_OVERLAP and pipeline.CHUNK_TOKENS > 0:
+                found, book.prev = drop_repeats(book.prev, found), found
+            book.raw.extend({**loc, **meta} for loc in found)
+    except BaseException:
+        if combined is not None:
+            combined.abort()
+        raise
+    finally:
+        metrics.observe("stage_seconds", time.perf_counter() - t0, stage="extract")
+        post.shutdown(wait=True)
+        for book in books:
+            if book.journal is not None:
+                book.journal.close()
+        if combined is not None:
+            combined.close()
+    return [book.report() for book in books]
+
+
+def print_report(reports: list[dict]) -> None:
+    print(f"\n  {'Book':<32} {'chunks':>7} {'LLM':>6} {'feats':>6} {'chunk/s':>8} {'secs':>8}")
+    for r in reports:
+        mark = "✗" if r["error"] else " "
+        print(f"{mark} {r['source'][:32]:<32} {r['chunks']:>7} {r['llm_calls']:>6} "
+              f"{r['features']:>6} {r['chunks_per_sec']:>8.2f} {r['total_seconds']:>8.1f}")
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch corpus mode — many books → GeoJSON")
+    parser.add_argument("input",            help="Directory of books or a manifest file")
+    parser.add_argument("--out-dir",        help="Per-book output directory (default: next to each book)")
+    parser.add_argument("--combined",       help="Combined output (default: <out-dir>/combined.geojson)")
+    parser.add_argument("--format",         choices=("collection", "ndjson"),
+                        help="Per-book output format (default: collection)")
+    parser.add_argument("--geocoder",       choices=("mapbox", "gazetteer"),
+                        default=pipeline.GEOCODER,
+                        help="Geocoding backend (default: $GEOCODER or mapbox)")
+    parser.add_argument("--gazetteer",      help="Compiled gazetteer index directory",
+                        default=pipeline.GAZETTEER_DIR)
+    parser.add_argument("--resume",         action="store_true",
+                        help="Skip chunks already in each book's journal")
+    parser.add_argument("--prefilter",      action=argparse.BooleanOptionalAction,
+                        default=pipeline.PREFILTER,
+                        help="Skip LLM calls for chunks with no place candidates")
+    parser.add_argument("--prometheus",     metavar="PATH",
+                        help="Also write run metrics in Prometheus text format")
+    args = parser.parse_args()
+    pipeline.GEOCODER, pipeline.GAZETTEER_DIR = args.geocoder, args.gazetteer
+
+    source  = Path(args.input)
+    if not source.exists():
+        print(f"Error: {source} not found")
+        sys.exit(1)
+    out_dir = Path(args.out_dir) if args.out_dir else None
+    books   = discover(source, out_dir, args.format)
+    if not books:
+        print(f"Error: no books found in {source}")
+        sys.exit(1)
+    report_dir = out_dir or (source if source.is_dir() else source.parent)
+    combined   = Path(args.combined) if args.combined else report_dir / "combined.geojson"
+
+    print(f"\n{'='*50}")
+    print(f"  Literary Geography Pipeline — batch")
+    print(f"{'='*50}")
+    print(f"  Books    : {len(books)}")
+    print(f"  Combined : {combined}")
+    print(f"{'='*50}\n")
+
+    metrics.reset()
+    t0 = time.perf_counter()
+    try:
+        reports = run_batch(books, args.format, combined, args.resume, args.prefilter)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    pipeline.print_cache_stats()
+    print_report(reports)
+
+    report_path = report_dir / "batch_report.json"
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    run = pipeline.run_report(seconds=round(time.perf_counter() - t0, 2), books=reports)
+    report_path.write_text(json.dumps(run, indent=2, ensure_ascii=False), encoding="utf-8")
+    pipeline.print_run_summary(run)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+    print(f"\n{'='*50}")
+    print(f"  Done. {sum(r['features'] for r in reports)} features → {combined}")
+    print(f"  Report → {report_path}")
+    print(f"{'='*50}\n")
+    sys.exit(1 if any(r["error"] for r in reports) else 0)
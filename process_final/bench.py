@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmark
+==================
+Times each pipeline stage over the real books in ``literature_data/`` with
+deterministic stand-ins for the heavy parts, so it needs no model downloads
+or network access and does the same work on every run:
+
+  Qwen    → StubLLM      candidate place spans from the chunk, wrapped in
+                         chatty prose + a fenced JSON array (exercises pull_json)
+  BGE-M3  → StubEncoder  hashed bag-of-words vectors
+  Mapbox  → local HTTP   a stub /forward endpoint behind the real MapboxGeocoder
+                         (cold cache every run)
+
+Per stage it reports items/s, MB/s and peak traced memory, and compares
+against a stored baseline:
+
+  python bench.py                       # run, compare with bench_baseline.json
+  python bench.py --save-baseline       # run and store the result as baseline
+  python bench.py --check               # exit 1 if any stage regressed
+"""
+
+import os
+import tempfile
+
+# Isolate the bench from the user's caches — must happen before pipeline import.
+os.environ["PIPELINE_CACHE_DIR"] = tempfile.mkdtemp(prefix="litgeo-bench-")
+os.environ["EMBED_CACHE"]        = "0"
+os.environ["LLM_CACHE"]          = "0"
+os.environ["CHUNK_TOKENS"]       = "0"   # character chunks: no tokenizer download
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import platform
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import pipeline
+from cache import geocode_cache
+from chunking import chunk_text, split_sentences
+from csv_to_geojson import csv_to_geojson
+from geocoding import MapboxGeocoder
+from geojson_stream import FeatureWriter
+from ingest import iter_chapters
+from metrics import peak_rss_bytes
+from prefilter import candidate_spans
+
+ROOT           = Path(__file__).resolve().parent.parent
+BOOKS_DIR      = ROOT / "literature_data"
+CSV_DIR        = ROOT / "csv_output"
+BENCH_BASELINE = Path(__file__).with_name("bench_baseline.json")
+TOLERANCE      = 0.25   # slower than baseline by more than this → regression
+
+# =============================================================================
+# STAND-INS
+# =============================================================================
+
+def _h(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+class StubLLM:
+    """Deterministic Qwen stand-in: capitalized spans + their sentence."""
+    model_id      = "bench-stub"
+    max_in_flight = 1
+
+    def generate(self, messages: list[dict], max_tokens: int, sampling: dict,
+                 usage: dict | None = None, stop=None, schema=None) -> str:
+        prompt = messages[-1]["content"]
+        chunk  = prompt.split("TEXT:\n", 1)[-1].split("\n\nReturn a JSON array", 1)[0]
+        return self.respond(chunk, usage)
+
+    @staticmethod
+    def respond(chunk: str, usage: dict | None = None) -> str:
+        items = []
+        for sent in split_sentences(chunk):
+            for span, _ in candidate_spans(sent):
+                if len(span) > 3:
+                    items.append({"name": span, "context": sent,
+                                  "sentiment": ("positive", "negative", "neutral")[_h(span) % 3]})
+                    break
+            if len(items) == 12:
+                break
+        out = "Here are the places I found:\n```json\n" + json.dumps(items, indent=2) + "\n```"
+        if usage is not None:
+            usage["prompt_tokens"]     = len(chunk.split())
+            usage["completion_tokens"] = len(out.split())
+        return out
+
+
+class StubEncoder:
+    """Deterministic BGE stand-in: hashed bag-of-words, L2-normalized."""
+    dim = 1024
+
+    def encode(self, texts: list[str], batch_size: int = 64,
+               normalize_embeddings: bool = True, convert_to_numpy: bool = True) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                out[i, _h(word) % self.dim] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-9)
+
+
+class _MapboxHandler(BaseHTTPRequestHandler):
+    protocol_version        = "HTTP/1.1"
+    disable_nagle_algorithm = True   # else headers/body split costs a 40 ms delayed ACK
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        q = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+        h = _h(q.lower())
+        features = [] if h % 10 == 0 else [{"geometry": {"coordinates": [
+            (h % 36000) / 100 - 180, (h // 36000 % 17000) / 100 - 85]}}]
+        body = json.dumps({"features": features}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def install_stubs() -> ThreadingHTTPServer:
+    """Point the pipeline at the stand-ins; returns the running stub server."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MapboxHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pipeline._llm      = StubLLM()
+    pipeline._geocoder = MapboxGeocoder("bench", f"http://127.0.0.1:{server.server_port}/",
+                                        rate=0)
+    pipeline.GEOCODER  = "mapbox"
+    pipeline.registry.register("bge", StubEncoder)
+    return server
+
+# =============================================================================
+# STAGES
+# =============================================================================
+
+def load_corpus() -> dict:
+    """Texts of every book plus the intermediate data later stages consume."""
+    books = {}
+    for path in sorted(BOOKS_DIR.glob("*.epub")):
+        books[path.stem] = "\n\n".join(text for _, text in iter_chapters(path))
+    chunks    = {name: chunk_text(text) for name, text in books.items()}
+    responses = [StubLLM.respond(c) for cs in chunks.values() for c in cs]
+    with contextlib.redirect_stdout(io.StringIO()):
+        raw = [loc for cs in chunks.values() for c in cs for loc in pipeline.extract_from_chunk(c)]
+    unique = pipeline.dedupe(raw)
+    return {"books": books, "chunks": chunks, "responses": responses, "raw": raw,
+            "unique": unique}
+
+
+def _mb(texts) -> float:
+    return sum(len(t.encode("utf-8")) for t in texts) / 2**20
+
+
+def stage_ingest(c: dict):
+    paths = sorted(BOOKS_DIR.glob("*.epub"))
+    texts = [t for p in paths for _, t in iter_chapters(p)]
+    return len(paths), _mb(texts)
+
+
+def stage_chunk_text(c: dict):
+    n = sum(len(chunk_text(text)) for text in c["books"].values())
+    return n, _mb(c["books"].values())
+
+
+def stage_pull_json(c: dict):
+    for r in c["responses"]:
+        pipeline.pull_json(r)
+    return len(c["responses"]), _mb(c["responses"])
+
+
+def stage_dedup(c: dict):
+    pipeline.dedupe(c["raw"])
+    return len(c["raw"]), None
+
+
+def stage_geocode(c: dict):
+    geocode_cache().clear()
+    names = [loc["name"] for loc in c["unique"]]
+    pipeline.geocode_all(names)
+    return len(names), None
+
+
+def stage_classify(c: dict):
+    pipeline._seed_vecs = None
+    contexts = [loc["context"] for loc in c["unique"]]
+    for start in range(0, len(contexts), pipeline.CLASSIFY_BATCH):
+        pipeline.classify_batch(contexts[start:start + pipeline.CLASSIFY_BATCH])
+    return len(contexts), _mb(contexts)
+
+
+def stage_csv_to_geojson(c: dict):
+    rows = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in sorted(CSV_DIR.glob("*.csv")):
+            csv_to_geojson(str(path), str(Path(tmp) / (path.stem + ".geojson")))
+            with open(path, newline="", encoding="utf-8") as fh:
+                rows += sum(1 for _ in csv.DictReader(fh))
+    return rows, _mb(p.read_text(encoding="utf-8") for p in sorted(CSV_DIR.glob("*.csv")))
+
+
+def stage_geojson_write(c: dict):
+    features = [{"type": "Feature",
+                 "geometry": {"type": "Point", "coordinates": [0.0, 0.0]},
+                 "properties": {"LocationName": loc["name"], "context": loc["context"],
+                                "Sentiment": loc["sentiment"], "Literature": "bench"}}
+                for loc in c["unique"]]
+    with tempfile.TemporaryDirectory() as tmp:
+        for suffix in (".geojson", ".ndjson"):
+            with FeatureWriter(Path(tmp) / ("out" + suffix)) as writer:
+                writer.write_all(features)
+    return 2 * len(features), None
+
+
+def stage_end_to_end(c: dict):
+    geocode_cache().clear()
+    n = 0
+    for name, text in c["books"].items():
+        n += len(pipeline.process(text, name)["features"])
+    return sum(len(cs) for cs in c["chunks"].values()), _mb(c["books"].values())
+
+
+STAGES = {
+    "ingest_epub":    (stage_ingest,         "books"),
+    "chunk_text":     (stage_chunk_text,     "chunks"),
+    "pull_json":      (stage_pull_json,      "responses"),
+    "dedup":          (stage_dedup,          "mentions"),
+    "geocode":        (stage_geocode,        "names"),
+    "classify":       (stage_classify,       "contexts"),
+    "csv_to_geojson": (stage_csv_to_geojson, "rows"),
+    "geojson_write":  (stage_geojson_write,  "features"),
+    "end_to_end":     (stage_end_to_end,     "chunks"),
+}
+
+# =============================================================================
+# RUNNER
+# =============================================================================
+
+def run_stage(fn, corpus: dict, repeat: int) -> dict:
+    """Best-of-``repeat`` wall time, then one traced run for peak memory."""
+    best = float("inf")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            items, mb = fn(corpus)
+            best = min(best, time.perf_counter() - t0)
+        tracemalloc.start()
+        fn(corpus)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "items":        items,
+        "seconds":      round(best, 5),
+        "items_per_s":  round(items / best, 2) if best else None,
+        "mb_per_s":     round(mb / best, 3) if mb is not None and best else None,
+        "peak_mem_mb":  round(peak / 2**20, 2),
+    }
+
+
+def environment() -> dict:
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.machine(), "cpus": os.cpu_count(), "numpy": np.__version__}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Names of stages whose throughput fell more than ``tolerance`` below baseline."""
+    regressed = []
+    for name, r in results.items():
+        base = baseline.get("stages", {}).get(name)
+        if not base or not base.get("items_per_s") or not r["items_per_s"]:
+            r["delta"] = None
+            continue
+        r["delta"] = round(r["items_per_s"] / base["items_per_s"] - 1, 4)
+        if r["delta"] < -tolerance:
+            regressed.append(name)
+    return regressed
+
+
+def print_table(results: dict, units: dict) -> None:
+    print(f"\n  {'stage':<16} {'items':>8} {'unit':<10} {'seconds':>9} {'items/s':>11} "
+          f"{'MB/s':>8} {'peak MB':>8} {'vs base':>8}")
+    for name, r in results.items():
+        delta = f"{r['delta']:+.1%}" if r.get("delta") is not None else "—"
+        mbs   = f"{r['mb_per_s']:.2f}" if r["mb_per_s"] is not None else "—"
+        print(f"  {name:<16} {r['items']:>8} {units[name]:<10} {r['seconds']:>9.4f} "
+              f"{r['items_per_s']:>11,.1f} {mbs:>8} {r['peak_mem_mb']:>8.1f} {delta:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages with stub models")
+    parser.add_argument("--stage",         action="append", choices=list(STAGES),
+                        help="Only run this stage (repeatable)")
+    parser.add_argument("--repeat",        type=int, default=3, help="Timed runs per stage (best of)")
+    parser.add_argument("--baseline",      default=str(BENCH_BASELINE), help="Baseline JSON path")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance",     type=float, default=TOLERANCE,
+                        help="Allowed throughput drop before a stage counts as regressed")
+    parser.add_argument("--check",         action="store_true", help="Exit 1 on any regression")
+    parser.add_argument("--json",          help="Also write the results here")
+    args = parser.parse_args()
+
+    if not any(BOOKS_DIR.glob("*.epub")):
+        print(f"Error: no .epub books in {BOOKS_DIR}")
+        sys.exit(1)
+
+    server = install_stubs()
+    print(f"⏳  Preparing corpus from {BOOKS_DIR}…", flush=True)
+    corpus = load_corpus()
+    print(f"✓   {len(corpus['books'])} book(s), {sum(map(len, corpus['chunks'].values()))} "
+          f"chunk(s), {len(corpus['raw'])} mention(s), {len(corpus['unique'])} unique", flush=True)
+
+    results = {}
+    for name in args.stage or STAGES:
+        fn, _ = STAGES[name]
+        print(f"  ▸ {name}", flush=True)
+        results[name] = run_stage(fn, corpus, max(1, args.repeat))
+    server.shutdown()
+
+    baseline_path = Path(args.baseline)
+    baseline  = (json.loads(baseline_path.read_text(encoding="utf-8"))
+                 if baseline_path.exists() else {})
+    regressed = compare(results, baseline, args.tolerance)
+    print_table(results, {name: unit for name, (_, unit) in STAGES.items()})
+    print(f"\n  Peak RSS {(peak_rss_bytes() or 0) / 2**20:.0f} MB")
+
+    report = {"environment": environment(), "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "repeat": args.repeat, "stages": results}
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"  Baseline saved → {baseline_path}")
+    elif baseline:
+        if baseline.get("environment") != report["environment"]:
+            print("  ⚠  Baseline was recorded on a different environment")
+        print(f"  {'✗ Regressed: ' + ', '.join(regressed) if regressed else '✓ No regressions'} "
+              f"(tolerance {args.tolerance:.0%}, baseline {baseline.get('created', '?')})")
+    else:
+        print(f"  No baseline at {baseline_path} — run with --save-baseline to create one")
+    sys.exit(1 if args.check and regressed else 0)
@@ -0,0 +1,256 @@
+"""
+Persistent on-disk cache
+========================
+A small SQLite-backed key/value store shared by the pipeline stages that talk
+to slow or metered services (geocoders, the LLM).  Values are stored as JSON.
+
+  * ``None`` is a legal value and is cached as a *negative* entry, so failed
+    lookups are not retried on every run.
+  * Positive and negative entries have separate expiry times.
+  * The table is trimmed to ``max_entries`` by least-recent access.
+  * Hit / miss counters are kept per instance (see ``DiskCache.stats``).
+
+The cache lives in ``$PIPELINE_CACHE_DIR`` (default: ``process_final/.cache``).
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+CACHE_DIR = Path(os.getenv("PIPELINE_CACHE_DIR",
+                           Path(__file__).resolve().parent / ".cache"))
+
+DAY = 86_400
+
+# Geocode cache defaults (overridable through the environment)
+GEOCODE_CACHE_TTL     = float(os.getenv("GEOCODE_CACHE_TTL_DAYS", "180")) * DAY
+GEOCODE_NEGATIVE_TTL  = float(os.getenv("GEOCODE_NEGATIVE_TTL_DAYS", "14")) * DAY
+GEOCODE_CACHE_MAX     = int(os.getenv("GEOCODE_CACHE_MAX", "500000"))
+
+# LLM response cache: no expiry, trimmed by least-recent use
+LLM_CACHE_MAX         = int(os.getenv("LLM_CACHE_MAX", "200000"))
+
+MISS = object()   # sentinel returned by DiskCache.get on a miss
+
+
+class DiskCache:
+    """Thread-safe SQLite key/value cache with TTLs and LRU trimming."""
+
+    def __init__(self, path: str | Path, table: str = "cache",
+                 ttl: float | None = None, negative_ttl: float | None = None,
+                 max_entries: int | None = None):
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", table):
+            raise ValueError(f"Invalid cache table name: {table!r}")
+        self.path         = Path(path)
+        self.table        = table
+        self.ttl          = ttl
+        self.negative_ttl = negative_ttl if negative_ttl is not None else ttl
+        self.max_entries  = max_entries
+        self.hits = self.misses = self.negative_hits = self.writes = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db   = sqlite3.connect(str(self.path), check_same_thread=False,
+                                     isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT,"
+            " expires REAL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._db.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table}(accessed)"
+        )
+
+    # ── lookups ──────────────────────────────────────────────────────────────
+
+    def get(self, key: str):
+        """Return the cached value (possibly ``None``) or ``MISS``."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                if row is not None:
+                    self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.misses += 1
+                return MISS
+            self._db.execute(
+                f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key)
+            )
+            value = json.loads(row[0])
+            self.hits += 1
+            if value is None:
+                self.negative_hits += 1
+            return value
+
+    def __contains__(self, key: str) -> bool:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None and (row[0] is None or row[0] >= now)
+
+    # ── writes ───────────────────────────────────────────────────────────────
+
+    def set(self, key: str, value) -> None:
+        """Store ``value``; ``None`` is stored as a negative entry."""
+        now = time.time()
+        ttl = self.negative_ttl if value is None else self.ttl
+        expires = now + ttl if ttl is not None else None
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires, accessed)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires, now),
+            )
+            self.writes += 1
+            if self.max_entries and self.writes % 256 == 0:
+                self._trim()
+
+    def _trim(self) -> None:
+        (count,) = self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f" SELECT key FROM {self.table} ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+
+    def purge_expired(self) -> int:
+        """Delete expired rows and trim to ``max_entries``; return rows removed."""
+        with self._lock:
+            cur = self._db.execute(
+                f"DELETE FROM {self.table} WHERE expires IS NOT NULL AND expires < ?",
+                (time.time(),),
+            )
+            removed = cur.rowcount
+            if self.max_entries:
+                before = len(self)
+                self._trim()
+                removed += before - len(self)
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self.max_entries:
+                self._trim()
+            self._db.close()
+
+    # ── introspection ────────────────────────────────────────────────────────
+
+    def __len__(self) -> int:
+        (count,) = self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return count
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits":          self.hits,
+            "misses":        self.misses,
+            "negative_hits": self.negative_hits,
+            "hit_rate":      round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries":       len(self),
+        }
+
+# =============================================================================
+# GEOCODE CACHE
+# =============================================================================
+
+_QUOTES = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"'})
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a place query: NFKC, casefolded, single-spaced."""
+    q = unicodedata.normalize("NFKC", query).translate(_QUOTES).casefold()
+    q = re.sub(r"\s+", " ", q)
+    return q.strip(" .,;:!?\"'()[]")
+
+
+def geocode_key(provider: str, query: str) -> str:
+    return f"{provider}\x1f{normalize_query(query)}"
+
+
+_geocache: DiskCache | None = None
+_cache_lock = threading.Lock()
+
+
+def geocode_cache() -> DiskCache:
+    """Process-wide geocode cache shared by every provider."""
+    global _geocache
+    with _cache_lock:
+        if _geocache is None:
+            _geocache = DiskCache(
+                CACHE_DIR / "geocode.sqlite", table="geocode",
+                ttl=GEOCODE_CACHE_TTL, negative_ttl=GEOCODE_NEGATIVE_TTL,
+                max_entries=GEOCODE_CACHE_MAX,
+            )
+        return _geocache
+
+
+def cached_geocode(provider: str, query: str, lookup):
+    """
+    Return ``lookup(query)`` through the geocode cache.
+
+    ``lookup`` must return the coordinates, ``None`` for a definitive
+    "no such place" answer (cached negatively), or raise on transient errors
+    (not cached).
+    """
+    cache = geocode_cache()
+    key   = geocode_key(provider, query)
+    value = cache.get(key)
+    if value is not MISS:
+        return tuple(value) if value is not None else None
+    value = lookup(query)
+    cache.set(key, list(value) if value is not None else None)
+    return value
+
+# =============================================================================
+# LLM RESPONSE CACHE
+# =============================================================================
+
+_llm_cache: DiskCache | None = None
+
+
+def llm_cache() -> DiskCache:
+    """Process-wide cache of generated LLM responses."""
+    global _llm_cache
+    with _cache_lock:
+        if _llm_cache is None:
+            _llm_cache = DiskCache(CACHE_DIR / "llm.sqlite", table="llm",
+                                   max_entries=LLM_CACHE_MAX)
+        return _llm_cache
+
+
+def llm_key(model_id: str, messages: list[dict], max_tokens: int, sampling: dict) -> str:
+    """
+    Digest of everything that determines a generation.  The chat messages stand
+    in for the rendered prompt: for a fixed model id the chat template is a pure
+    function of them, and a hit then never needs the tokenizer loaded.
+    """
+    payload = json.dumps([model_id, messages, max_tokens, sampling],
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def disambiguation_key(model_id: str, name: str, context: str) -> str:
+    """Key of one resolved place mention: (surface form, context hash) per model."""
+    digest = hashlib.sha256(context.encode("utf-8")).hexdigest()[:32]
+    return f"disambig\x1f{model_id}\x1f{normalize_query(name)}\x1f{digest}"
@@ -0,0 +1,172 @@
+"""
+Place-name canonicalization
+===========================
+Clusters the surface forms of a place before geocoding, so "NYC",
+"New York City", "New York" and "new york, ny" cost one lookup instead of
+four.  ``canonicalize(names)`` returns, for every input name, the query that
+stands for its cluster; the caller geocodes the distinct queries once and
+fans the coordinates back out to every mention.
+
+Clustering, in order:
+  1. normalization   casefold, NFKC, no diacritics / dots / hyphens /
+                     possessives, no leading "the", saint→st, mount→mt, fort→ft, and
+                     ", NY"-style qualifiers expanded to the state name
+  2. alias table     nicknames and abbreviations (ALIASES)
+  3. qualifiers      a bare "Denver" joins "Denver, Colorado" when that is
+                     the only qualified Denver in the batch and its qualifier
+                     is a US state (a bare "Georgia" never becomes
+                     "Georgia, USSR")
+  4. fuzzy matching  difflib ratio ≥ FUZZY_CUTOFF against a more frequent
+                     cluster with the same first letter and the same numbers,
+                     unless one name merely extends the other
+                     ("Missisippi" → "Mississippi", never "Route 6" → "Route 66"
+                     or "Indian" → "Indiana")
+
+A cluster is queried by its alias display name, else its most frequent
+surface form.
+"""
+
+import difflib
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+from cache import normalize_query
+
+FUZZY_CUTOFF  = 0.9
+FUZZY_MIN_LEN = 6   # shorter names are too easy to confuse ("Reno" / "Remo")
+
+US_STATES = {
+    "al": "alabama", "ak": "alaska", "az": "arizona", "ar": "arkansas",
+    "ca": "california", "co": "colorado", "ct": "connecticut", "de": "delaware",
+    "fl": "florida", "ga": "georgia", "hi": "hawaii", "id": "idaho",
+    "il": "illinois", "in": "indiana", "ia": "iowa", "ks": "kansas",
+    "ky": "kentucky", "la": "louisiana", "me": "maine", "md": "maryland",
+    "ma": "massachusetts", "mi": "michigan", "mn": "minnesota", "ms": "mississippi",
+    "mo": "missouri", "mt": "montana", "ne": "nebraska", "nv": "nevada",
+    "nh": "new hampshire", "nj": "new jersey", "nm": "new mexico", "ny": "new york",
+    "nc": "north carolina", "nd": "north dakota", "oh": "ohio", "ok": "oklahoma",
+    "or": "oregon", "pa": "pennsylvania", "ri": "rhode island", "sc": "south carolina",
+    "sd": "south dakota", "tn": "tennessee", "tx": "texas", "ut": "utah",
+    "vt": "vermont", "va": "virginia", "wa": "washington", "wv": "west virginia",
+    "wi": "wisconsin", "wy": "wyoming", "dc": "district of columbia",
+    "calif": "california", "mass": "massachusetts", "penn": "pennsylvania",
+}
+
+_STATE_NAMES = set(US_STATES.values())
+
+# Qualifiers that add nothing to a US-centric query.
+_COUNTRY_QUALIFIERS = {"us", "usa", "united states", "united states of america", "america"}
+
+# Normalized key → query used for the whole cluster.
+ALIASES = {
+    "nyc":                 "New York City",
+    "new york city":       "New York City",
+    "new york":            "New York City",
+    "new york, new york":  "New York City",
+    "big apple":           "New York City",
+    "la":                  "Los Angeles",
+    "los angeles":         "Los Angeles",
+    "los angeles, california": "Los Angeles",
+    "sf":                  "San Francisco",
+    "frisco":              "San Francisco",
+    "san fran":            "San Francisco",
+    "san francisco":       "San Francisco",
+    "san francisco, california": "San Francisco",
+    "philly":              "Philadelphia",
+    "philadelphia":        "Philadelphia",
+    "nola":                "New Orleans",
+    "new orleans":         "New Orleans",
+    "new orleans, louisiana": "New Orleans",
+    "vegas":               "Las Vegas",
+    "las vegas":           "Las Vegas",
+    "dc":                  "Washington, DC",
+    "washington dc":       "Washington, DC",
+    "washington, district of columbia": "Washington, DC",
+    "district of columbia": "Washington, DC",
+    "usa":                 "United States",
+    "us":                  "United States",
+    "united states":       "United States",
+    "united states of america": "United States",
+    "states":              "United States",
+}
+
+_TOKEN_SUBS = {"saint": "st", "mount": "mt", "fort": "ft"}
+_POSSESSIVE = re.compile(r"['’]s\b")
+_DROP       = re.compile(r"[.'’]")
+_SPACE      = re.compile(r"[^\w,]+")
+
+
+def canonical_key(name: str) -> str:
+    """Normalized cluster key, e.g. "New York, NY" → "new york, new york"."""
+    q = unicodedata.normalize("NFKD", normalize_query(name))
+    q = "".join(c for c in q if not unicodedata.combining(c))
+    q = _SPACE.sub(" ", _DROP.sub("", _POSSESSIVE.sub("", q)))
+    parts = [" ".join(_TOKEN_SUBS.get(t, t) for t in p.split()) for p in q.split(",")]
+    parts = [p for p in parts if p]
+    if not parts:
+        return ""
+    if parts[0].startswith("the "):
+        parts[0] = parts[0][4:]
+    base, quals = parts[0], [US_STATES.get(p, p) for p in parts[1:]]
+    quals = [p for p in quals if p not in _COUNTRY_QUALIFIERS]
+    return ", ".join([base] + quals[:1])
+
+
+def _split(key: str) -> tuple[str, str]:
+    base, _, qual = key.partition(", ")
+    return base, qual
+
+
+def canonicalize(names: list[str]) -> list[str]:
+    """The geocoding query for each of ``names`` (same order, one per cluster)."""
+    keys   = [canonical_key(n) for n in names]
+    counts = Counter(keys)
+
+    # 1–2. normalization + alias table: key → cluster id
+    cluster: dict[str, str] = {}
+    for key in counts:
+        cluster[key] = "=" + ALIASES[key] if key in ALIASES else key
+
+    # 3. bare name → its only qualified variant, when qualified by a US state
+    qualified: dict[str, set[str]] = defaultdict(set)
+    for key in counts:
+        base, qual = _split(key)
+        if qual and not cluster[key].startswith("="):
+            qualified[base].add(key)
+    for key in counts:
+        if cluster[key] == key and not _split(key)[1] and len(qualified.get(key, ())) == 1:
+            only = next(iter(qualified[key]))
+            if _split(only)[1] in _STATE_NAMES:
+                cluster[key] = only
+
+    # 4. fuzzy: fold rarer clusters into a close, more frequent one
+    sizes: Counter = Counter()
+    for key, n in counts.items():
+        sizes[cluster[key]] += n
+    blocks: dict[str, list[str]] = defaultdict(list)
+    merged: dict[str, str] = {}
+    for cid, _ in sorted(sizes.items(), key=lambda kv: (-kv[1], kv[0])):
+        if cid.startswith("=") or len(cid) < FUZZY_MIN_LEN:
+            continue
+        block = blocks[cid[0]]
+        digits = re.findall(r"\d+", cid)
+        match = next((m for m in difflib.get_close_matches(cid, block, n=3, cutoff=FUZZY_CUTOFF)
+                      if re.findall(r"\d+", m) == digits
+                      and not (m.startswith(cid) or cid.startswith(m))), None)
+        if match:
+            merged[cid] = match
+        else:
+            block.append(cid)
+    for key in cluster:
+        cluster[key] = merged.get(cluster[key], cluster[key])
+
+    # Query per cluster: alias display name, else the most frequent surface
+    # form of the cluster's own key (so "Denver, Colorado" beats a bare "Denver").
+    surfaces: dict[str, Counter] = defaultdict(Counter)
+    for name, key in zip(names, keys):
+        surfaces[cluster[key]][(key == cluster[key], name.strip())] += 1
+    query = {cid: cid[1:] if cid.startswith("=")
+             else max(forms.items(), key=lambda kv: (kv[0][0], kv[1], -len(kv[0][1])))[0][1]
+             for cid, forms in surfaces.items()}
+    return [query[cluster[key]] for key in keys]
@@ -0,0 +1,207 @@
+"""
+Chunking
+========
+Splits book text into LLM-sized chunks.
+
+  chunk_text       paragraphs packed up to a character budget (original scheme)
+  chunk_by_tokens  paragraphs packed up to a *token* budget measured with the
+                   model's own tokenizer; over-long paragraphs are split on
+                   sentence boundaries (and, as a last resort, on words), and
+                   an optional token overlap repeats the tail of each chunk at
+                   the head of the next.
+
+Every packer has a generator form (``iter_chunks`` / ``iter_token_chunks``)
+that consumes paragraphs lazily — from a string (``iter_paragraphs``) or a
+memory-mapped file (``iter_file_paragraphs``) — so chunks can flow straight
+into extraction without the whole book being split up front.
+
+Mentions extracted twice from an overlap are removed by ``drop_repeats``.
+"""
+
+import mmap
+import re
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+CHUNK_SIZE = 1600   # characters per LLM call for chunk_text
+
+_PARA_SPLIT   = re.compile(r"\n{2,}")
+_PARA_SPLIT_B = re.compile(rb"(?:\r\n|\r(?!\n)|\n){2,}")   # any newline style, as read_text() sees it
+_SENT_SPLIT   = re.compile(r"(?<=[.!?…])[\"'”’)\]]*\s+(?=[\"'“‘(\[]?[A-Z0-9])")
+
+# =============================================================================
+# PARAGRAPH SOURCES  (lazy — nothing is split up front)
+# =============================================================================
+
+def iter_paragraphs(text: str) -> Iterator[str]:
+    """Non-empty, stripped paragraphs of ``text``, produced lazily."""
+    start = 0
+    for m in _PARA_SPLIT.finditer(text):
+        para = text[start:m.start()].strip()
+        if para:
+            yield para
+        start = m.end()
+    para = text[start:].strip()
+    if para:
+        yield para
+
+
+def iter_file_paragraphs(path: str | Path, encoding: str = "utf-8") -> Iterator[str]:
+    """
+    Paragraphs of a text file, read through a memory map: only the current
+    paragraph is ever decoded, so memory stays flat for any file size.
+    CRLF / CR line endings are normalized to ``\n`` like ``Path.read_text()``.
+    """
+    with open(path, "rb") as fh:
+        if fh.seek(0, 2) == 0:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 3 if mm[:3] == b"\xef\xbb\xbf" else 0   # UTF-8 BOM
+            for m in _PARA_SPLIT_B.finditer(mm, start):
+                para = _decode_para(mm[start:m.start()], encoding)
+                if para:
+                    yield para
+                start = m.end()
+            para = _decode_para(mm[start:], encoding)
+            if para:
+                yield para
+
+
+def _decode_para(raw: bytes, encoding: str) -> str:
+    return raw.decode(encoding).replace("\r\n", "\n").replace("\r", "\n").strip()
+
+# =============================================================================
+# CHARACTER PACKING
+# =============================================================================
+
+def iter_chunks(paragraphs: Iterable[str], size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Pack paragraphs into chunks of about ``size`` characters."""
+    current = ""
+    for para in paragraphs:
+        if len(current) + len(para) > size and current:
+            yield current.strip()
+            current = para + "\n\n"
+        else:
+            current += para + "\n\n"
+    if current.strip():
+        yield current.strip()
+
+
+def chunk_text(text: str, size: int = CHUNK_SIZE) -> list[str]:
+    """Split on paragraph breaks; keep each chunk under `size` characters."""
+    return list(iter_chunks(iter_paragraphs(text), size))
+
+# =============================================================================
+# TOKEN PACKING
+# =============================================================================
+
+def split_sentences(text: str) -> list[str]:
+    return [s.strip() for s in _SENT_SPLIT.split(text) if s.strip()]
+
+
+def _split_words(text: str, budget: int, count: Callable[[str], int]) -> list[str]:
+    """Hard split of a single over-long sentence into pieces under ``budget``."""
+    pieces, current = [], []
+    for word in text.split():
+        if current and count(" ".join(current + [word])) > budget:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _units(paragraphs: Iterable[str], budget: int, count: Callable[[str], int]):
+    """Yield (text, tokens, joiner) units that each fit in ``budget``."""
+    for para in paragraphs:
+        n = count(para)
+        if n <= budget:
+            yield para, n, "\n\n"
+            continue
+        for i, sent in enumerate(split_sentences(para)):
+            joiner = "\n\n" if i == 0 else " "
+            m = count(sent)
+            if m <= budget:
+                yield sent, m, joiner
+            else:
+                for j, piece in enumerate(_split_words(sent, budget, count)):
+                    yield piece, count(piece), joiner if j == 0 else " "
+
+
+def iter_token_chunks(paragraphs: Iterable[str], count: Callable[[str], int],
+                      budget: int, overlap: int = 0) -> Iterator[str]:
+    """
+    Pack paragraphs into chunks of at most ``budget`` tokens (per ``count``).
+
+    With ``overlap`` > 0, trailing sentences of each chunk worth up to
+    ``overlap`` tokens are repeated at the start of the next one, so a mention
+    that straddles a boundary is seen whole at least once.
+    """
+    sep = 2   # allowance for the joiner between units
+    current: list[tuple[str, int, str]] = []
+    used = 0
+
+    def joined() -> str:
+        return "".join((j if k else "") + t for k, (t, _, j) in enumerate(current)).strip()
+
+    for unit in _units(paragraphs, budget, count):
+        if current and used + unit[1] + sep > budget:
+            yield joined()
+            carry: list[tuple[str, int, str]] = []
+            if overlap:
+                tail = split_sentences(current[-1][0])
+                kept = 0
+                for sent in reversed(tail):
+                    n = count(sent)
+                    if kept + n > overlap or kept + n + unit[1] + sep > budget:
+                        break
+                    carry.insert(0, (sent, n, " "))
+                    kept += n + sep
+            current, used = carry, sum(n + sep for _, n, _ in carry)
+        current.append(unit)
+        used += unit[1] + sep
+    if current:
+        yield joined()
+
+
+def chunk_by_tokens(text: str, count: Callable[[str], int], budget: int,
+                    overlap: int = 0) -> list[str]:
+    return list(iter_token_chunks(iter_paragraphs(text), count, budget, overlap))
+
+def with_offsets(text: str, chunks: Iterable[str]) -> Iterator[tuple[str, int]]:
+    """
+    ``(chunk, offset)`` pairs, where offset is the character position in
+    ``text`` where the chunk starts (chunks are whitespace-normalized copies,
+    so their first few words are searched for, moving forward only).
+    """
+    pos = 0
+    for chunk in chunks:
+        words = chunk.split()[:6]
+        m = re.compile(r"\s+".join(map(re.escape, words))).search(text, pos) if words else None
+        if m:
+            pos = m.start()
+        yield chunk, pos
+
+# =============================================================================
+# OVERLAP DEDUP
+# =============================================================================
+
+def _squash(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def drop_repeats(prev: list[dict], found: list[dict]) -> list[dict]:
+    """
+    Mentions of ``found`` that were not already extracted from the previous
+    chunk ``prev`` (same place name, one context contained in the other).
+    """
+    seen = [(loc["name"].lower(), _squash(loc["context"])) for loc in prev]
+    kept = []
+    for loc in found:
+        name, ctx = loc["name"].lower(), _squash(loc["context"])
+        if any(name == p_name and (ctx in p_ctx or p_ctx in ctx) for p_name, p_ctx in seen):
+            continue
+        kept.append(loc)
+    return kept
+
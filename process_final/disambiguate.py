@@ -0,0 +1,115 @@
+"""
+GPT place disambiguation
+========================
+Resolves (location name, context) mentions to accurate, complete place names
+for process.py.  Mentions are sent GPT_BATCH_SIZE at a time as one structured
+request, up to GPT_INFLIGHT requests run concurrently, and answers are cached
+per (model, surface form, context hash) in the LLM cache (see cache.py).
+
+Any OpenAI-compatible chat completions endpoint works; OPENAI_BASE_URL may
+point at a local server or stub.  The backend is created on first use, so
+importing this module needs no API key.
+"""
+
+import json
+import os
+
+from cache import MISS, disambiguation_key, llm_cache
+from jsonstream import ArrayScanner, pull_json
+from llm import OpenAIBackend, generate_many
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+GPT_MODEL       = os.getenv("GPT_MODEL", "gpt-4o-mini")
+GPT_BATCH_SIZE  = int(os.getenv("GPT_BATCH_SIZE", "25"))   # mentions per request
+GPT_INFLIGHT    = int(os.getenv("GPT_INFLIGHT", "4"))      # concurrent requests
+GPT_SAMPLING    = {"temp": 0.0, "top_p": 1.0}              # deterministic, so answers can be cached
+
+_GPT_SYSTEM = (
+    "You resolve place mentions in literary text to accurate, complete place names. "
+    "Reply ONLY with a valid JSON array, no prose."
+)
+
+_GPT_TEMPLATE = """Each mention below has an "id", the location "name" as written, and the
+"context" it appears in.  For each mention, give the most accurate and complete
+name of the location being referred to.  If the location is ambiguous, use the
+context to resolve it.
+
+MENTIONS:
+{mentions}
+
+Return a JSON array with one element per mention: {{"id": <id>, "location": "<accurate name>"}}
+
+JSON:"""
+
+_gpt: OpenAIBackend | None = None
+
+
+def get_gpt() -> OpenAIBackend:
+    """The chat completions backend; created on first use."""
+    global _gpt
+    if _gpt is None:
+        _gpt = OpenAIBackend(GPT_MODEL, url=OPENAI_BASE_URL,
+                             api_key=os.getenv("OPENAI_API_KEY", ""),
+                             max_in_flight=GPT_INFLIGHT)
+    return _gpt
+
+
+def analyze_locations_with_gpt(mentions: list[tuple[str, str]]) -> list[str]:
+    """
+    One location name per (location_name, context) mention, falling back to
+    the original name when GPT gives no answer.  Only mentions missing from
+    the cache are sent, each distinct one once.
+    """
+    cache = llm_cache()
+    keys  = [disambiguation_key(GPT_MODEL, name, context) for name, context in mentions]
+    resolved: dict[str, str] = {}
+    pending: dict[str, tuple[str, str]] = {}
+    for key, mention in zip(keys, mentions):
+        cached = cache.get(key)
+        if cached is not MISS:
+            resolved[key] = cached
+        else:
+            pending.setdefault(key, mention)
+    pending_keys = list(pending)
+    batches = [pending_keys[i:i + GPT_BATCH_SIZE]
+               for i in range(0, len(pending_keys), GPT_BATCH_SIZE)]
+    print(f"Disambiguating {len(mentions)} mentions: {len(resolved)} cached, "
+          f"{len(pending)} in {len(batches)} GPT requests")
+
+    def resolve_batch(batch):
+        return _resolve_batch([pending[key] for key in batch])
+
+    for batch, answers in zip(batches, generate_many(resolve_batch, batches,
+                                                     min(GPT_INFLIGHT, len(batches)))):
+        for key, answer in zip(batch, answers):
+            if answer:
+                cache.set(key, answer)
+                resolved[key] = answer
+    return [resolved.get(key) or name for key, (name, _) in zip(keys, mentions)]
+
+
+def _resolve_batch(batch: list[tuple[str, str]]) -> list[str | None]:
+    """
+    One chat completion resolving a batch of mentions; answers in batch order
+    (None where GPT gave none or the request failed).
+    """
+    items = [{"id": i, "name": name, "context": context}
+             for i, (name, context) in enumerate(batch)]
+    messages = [
+        {"role": "system", "content": _GPT_SYSTEM},
+        {"role": "user", "content": _GPT_TEMPLATE.format(
+            mentions=json.dumps(items, ensure_ascii=False))},
+    ]
+    try:
+        reply = get_gpt().generate(messages, 40 * len(batch) + 50, GPT_SAMPLING,
+                                   stop=ArrayScanner().feed)
+    except Exception as e:
+        print(f"Error analyzing locations with GPT: {e}")
+        return [None] * len(batch)
+    answers: list[str | None] = [None] * len(batch)
+    results = pull_json(reply)
+    for item in results if isinstance(results, list) else []:
+        if isinstance(item, dict) and isinstance(item.get("id"), int) \
+                and 0 <= item["id"] < len(batch):
+            answers[item["id"]] = str(item.get("location") or "").strip() or None
+    return answers
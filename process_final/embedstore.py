@@ -0,0 +1,161 @@
+"""
+Content-addressed embedding store
+=================================
+Persistent cache of sentence embeddings keyed by
+``blake2b(model id + normalized text)``, so a context sentence is encoded by
+BGE-M3 once — across runs, books and threshold changes.
+
+On disk (one directory per model under ``$PIPELINE_CACHE_DIR/embeddings``)
+  vectors.f16   raw float16 matrix, one row per stored text (memory-mapped)
+  index.bin     16-byte digest per row, in row order
+  meta.json     model id and vector dimension
+
+Both files are append-only.  The index is written after the vectors, and on
+open (and before every append) both files are truncated to the rows present
+in full in each, so an interrupted write never misaligns the two.  Appends
+hold an exclusive lock on ``.lock`` and first pick up rows other processes
+added, so a batch run and a pipeline run can share the store.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from cache import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:   # Windows: no cross-process lock
+    fcntl = None
+
+EMBED_DIR   = CACHE_DIR / "embeddings"
+DIGEST_SIZE = 16
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+class EmbeddingStore:
+    """Append-only float16 embedding matrix with a digest → row index."""
+
+    def __init__(self, model_id: str, root: str | Path = EMBED_DIR):
+        self.model_id = model_id
+        self.dir      = Path(root) / re.sub(r"[^A-Za-z0-9._-]+", "__", model_id)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._vec_path = self.dir / "vectors.f16"
+        self._idx_path = self.dir / "index.bin"
+        self._meta     = self.dir / "meta.json"
+        self._lock     = threading.Lock()
+        self.hits = self.misses = 0
+
+        self._rows: dict[bytes, int] = {}
+        self._n   = 0      # rows on disk that this instance has read
+        self.dim  = None
+        self._mat = None
+        with self._file_lock():
+            self._sync()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared by every process using this store."""
+        with open(self.dir / ".lock", "a+b") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _sync(self) -> None:
+        """
+        Under the file lock: cut both files back to the rows present in full
+        in each (dropping any torn tail), then read rows appended since.
+        """
+        if self.dim is None and self._meta.exists():
+            self.dim = json.loads(self._meta.read_text())["dim"]
+        if self.dim is None:
+            return
+        idx_size = self._idx_path.stat().st_size if self._idx_path.exists() else 0
+        vec_size = self._vec_path.stat().st_size if self._vec_path.exists() else 0
+        n = min(idx_size // DIGEST_SIZE, vec_size // (self.dim * 2))
+        for path, size in ((self._idx_path, n * DIGEST_SIZE), (self._vec_path, n * self.dim * 2)):
+            if path.exists() and path.stat().st_size != size:
+                with open(path, "r+b") as fh:
+                    fh.truncate(size)
+        if n > self._n:
+            with open(self._idx_path, "rb") as fh:
+                fh.seek(self._n * DIGEST_SIZE)
+                digests = fh.read((n - self._n) * DIGEST_SIZE)
+            for i in range(n - self._n):
+                self._rows[digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]] = self._n + i
+            self._n = n
+        self._map()
+
+    def _map(self) -> None:
+        self._mat = np.memmap(self._vec_path, dtype=np.float16, mode="r",
+                              shape=(self._n, self.dim)) if self._n else None
+
+    def key(self, text: str) -> bytes:
+        h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        h.update(self.model_id.encode("utf-8") + b"\0" + normalize_text(text).encode("utf-8"))
+        return h.digest()
+
+    def _append(self, keys: list[bytes], vecs: np.ndarray) -> None:
+        with self._file_lock():
+            self._sync()
+            if self.dim is None:
+                self.dim = int(vecs.shape[1])
+                self._meta.write_text(json.dumps({"model_id": self.model_id, "dim": self.dim}))
+            elif vecs.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {vecs.shape[1]} != stored dim {self.dim}")
+            # Another process may have stored some of these since we checked.
+            new = [i for i, k in enumerate(keys) if k not in self._rows]
+            if not new:
+                return
+            if len(new) < len(keys):
+                keys, vecs = [keys[i] for i in new], vecs[new]
+            with open(self._vec_path, "ab") as fh:
+                fh.write(np.ascontiguousarray(vecs, dtype=np.float16).tobytes())
+            with open(self._idx_path, "ab") as fh:
+                fh.write(b"".join(keys))
+            for k in keys:
+                self._rows[k] = self._n
+                self._n += 1
+            self._map()
+
+    def encode(self, texts: list[str],
+               encoder: Callable[[list[str]], np.ndarray]) -> np.ndarray:
+        """
+        Embeddings for ``texts`` as float32 rows, calling ``encoder`` only for
+        texts not yet in the store (each distinct text once).
+        """
+        keys = [self.key(t) for t in texts]
+        with self._lock:
+            missing: dict[bytes, str] = {}
+            for k, t in zip(keys, texts):
+                if k not in self._rows and k not in missing:
+                    missing[k] = t
+            self.hits   += sum(1 for k in keys if k in self._rows)
+            self.misses += len(missing)
+            if missing:
+                fresh = np.asarray(encoder(list(missing.values())), dtype=np.float32)
+                self._append(list(missing), fresh)
+            if not texts:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            return np.asarray(self._mat[[self._rows[k] for k in keys]], dtype=np.float32)
+
+    @property
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Offline Gazetteer Geocoder
+==========================
+Drop-in, network-free alternative to the Mapbox geocoder.  A GeoNames-style
+TSV dump (``allCountries.txt``, ``cities500.txt``, …) is compiled once into a
+directory of flat ``.npy`` arrays which are memory-mapped at load time, so
+start-up costs milliseconds and the OS shares the pages between processes.
+
+Index layout  (all sorted by ``key``, then by descending population)
+------------
+  keys.npy         uint8   concatenated UTF-8 normalized names
+  key_offsets.npy  int64   start of key i in keys.npy (n_keys + 1 entries)
+  key_place.npy    int32   place id for key i
+  names.npy        uint8   concatenated UTF-8 primary names
+  name_offsets.npy int64   start of place name j (n_places + 1 entries)
+  coords.npy       float32 [lon, lat] per place
+  population.npy   int64   population per place
+  country.npy      S2      ISO country code per place
+
+Every primary, ASCII and alternate name becomes a key, so "NYC", "New York"
+and "Nueva York" all land on the same place.
+
+Usage
+-----
+  python gazetteer.py build allCountries.txt --out .cache/gazetteer
+  python gazetteer.py lookup .cache/gazetteer "Denver" "walden pond"
+  GEOCODER=gazetteer python pipeline.py my_book.txt
+"""
+
+import argparse
+import sys
+import time
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from cache import CACHE_DIR, normalize_query
+
+GAZETTEER_DIR = CACHE_DIR / "gazetteer"
+
+# GeoNames "geoname" table columns
+_COL_NAME, _COL_ASCII, _COL_ALT = 1, 2, 3
+_COL_LAT, _COL_LON, _COL_CC, _COL_POP = 4, 5, 8, 14
+
+
+def gazetteer_key(name: str) -> str:
+    """Normalized lookup key: ``normalize_query`` with diacritics removed."""
+    q = unicodedata.normalize("NFKD", normalize_query(name))
+    return "".join(c for c in q if not unicodedata.combining(c))
+
+# =============================================================================
+# BUILD
+# =============================================================================
+
+def build_index(tsv_path: str | Path, out_dir: str | Path = GAZETTEER_DIR,
+                min_population: int = 0) -> int:
+    """Compile a GeoNames TSV into ``out_dir``; return the number of places."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    names:   list[bytes] = []
+    coords:  list[tuple[float, float]] = []
+    pops:    list[int] = []
+    ccs:     list[str] = []
+    entries: list[tuple[bytes, int, int]] = []   # (key, -population, place id)
+
+    with open(tsv_path, encoding="utf-8") as fh:
+        for line in fh:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) <= _COL_POP:
+                continue
+            try:
+                lat, lon = float(cols[_COL_LAT]), float(cols[_COL_LON])
+                pop = int(cols[_COL_POP] or 0)
+            except ValueError:
+                continue
+            if pop < min_population:
+                continue
+            pid = len(names)
+            names.append(cols[_COL_NAME].encode("utf-8"))
+            coords.append((lon, lat))
+            pops.append(pop)
+            ccs.append(cols[_COL_CC])
+            variants = {cols[_COL_NAME], cols[_COL_ASCII],
+                        *cols[_COL_ALT].split(",")}
+            for key in {gazetteer_key(v) for v in variants if v}:
+                if key:
+                    entries.append((key.encode("utf-8"), -pop, pid))
+
+    entries.sort()
+    _save_blob(out_dir, "keys", [e[0] for e in entries])
+    np.save(out_dir / "key_place.npy", np.array([e[2] for e in entries], dtype=np.int32))
+    _save_blob(out_dir, "names", names)
+    np.save(out_dir / "coords.npy", np.array(coords, dtype=np.float32).reshape(-1, 2))
+    np.save(out_dir / "population.npy", np.array(pops, dtype=np.int64))
+    np.save(out_dir / "country.npy", np.array(ccs, dtype="S2"))
+    return len(names)
+
+
+def _save_blob(out_dir: Path, stem: str, items: list[bytes]) -> None:
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in items], out=offsets[1:])
+    np.save(out_dir / f"{stem}.npy", np.frombuffer(b"".join(items), dtype=np.uint8))
+    np.save(out_dir / f"{stem.rstrip('s')}_offsets.npy", offsets)
+
+# =============================================================================
+# LOOKUP
+# =============================================================================
+
+class Gazetteer:
+    """Memory-mapped, read-only view of a compiled gazetteer index."""
+
+    def __init__(self, index_dir: str | Path = GAZETTEER_DIR):
+        d = Path(index_dir)
+        if not (d / "key_place.npy").exists():
+            raise FileNotFoundError(
+                f"No gazetteer index in {d} — run `python gazetteer.py build <tsv>`"
+            )
+        load = lambda n: np.load(d / f"{n}.npy", mmap_mode="r")
+        self._keys        = load("keys")
+        self._key_offsets = load("key_offsets")
+        self._key_place   = load("key_place")
+        self._names       = load("names")
+        self._name_offsets = load("name_offsets")
+        self.coords       = load("coords")
+        self.population   = load("population")
+        self.country      = load("country")
+        self._keys_buf    = memoryview(self._keys)
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def _key(self, i: int) -> bytes:
+        return bytes(self._keys_buf[self._key_offsets[i]:self._key_offsets[i + 1]])
+
+    def _lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, len(self._key_place)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def name(self, pid: int) -> str:
+        a, b = self._name_offsets[pid], self._name_offsets[pid + 1]
+        return bytes(self._names[a:b]).decode("utf-8")
+
+    def _accept(self, pid: int, countries) -> bool:
+        return not countries or self.country[pid].decode() in countries
+
+    def normalized(self, query: str, limit: int = 5, countries=None) -> list[int]:
+        """Place ids whose (alternate) names normalize to ``query``, by population."""
+        key = gazetteer_key(query).encode("utf-8")
+        i, out = self._lower_bound(key), []
+        while i < len(self._key_place) and self._key(i) == key and len(out) < limit:
+            pid = int(self._key_place[i])
+            if pid not in out and self._accept(pid, countries):
+                out.append(pid)
+            i += 1
+        return out
+
+    def exact(self, query: str, limit: int = 5, countries=None) -> list[int]:
+        """Places whose primary name is exactly ``query`` (case-sensitive)."""
+        return [pid for pid in self.normalized(query, limit=10 * limit, countries=countries)
+                if self.name(pid) == query][:limit]
+
+    def prefix(self, query: str, limit: int = 10, countries=None,
+               max_scan: int = 5000) -> list[int]:
+        """Places with a name starting with ``query``, ranked by population."""
+        key = gazetteer_key(query).encode("utf-8")
+        i, seen = self._lower_bound(key), set()
+        stop = min(len(self._key_place), i + max_scan)
+        while i < stop and self._key(i).startswith(key):
+            pid = int(self._key_place[i])
+            if self._accept(pid, countries):
+                seen.add(pid)
+            i += 1
+        return sorted(seen, key=lambda p: -int(self.population[p]))[:limit]
+
+    def lookup(self, query: str, countries=None) -> tuple[float, float] | None:
+        """Best match as ``(lon, lat)``: exact name, then normalized, else None."""
+        hits = self.exact(query, 1, countries) or self.normalized(query, 1, countries)
+        if not hits:
+            return None
+        lon, lat = self.coords[hits[0]]
+        return round(float(lon), 5), round(float(lat), 5)   # float32 ≈ 1 m
+
+
+class GazetteerGeocoder:
+    """Same interface as ``geocoding.MapboxGeocoder`` but fully offline."""
+    provider = "gazetteer"
+
+    def __init__(self, index_dir: str | Path = GAZETTEER_DIR, countries=None):
+        self.index     = Gazetteer(index_dir)
+        self.countries = set(countries) if countries else None
+
+    def geocode(self, name: str) -> tuple[float, float] | None:
+        return self.index.lookup(name, self.countries)
+
+    def geocode_all(self, names: list[str]) -> list[tuple[float, float] | None]:
+        memo: dict[str, tuple[float, float] | None] = {}
+        out = []
+        for name in names:
+            if name not in memo:
+                memo[name] = self.geocode(name)
+            out.append(memo[name])
+        return out
+
+    def close(self) -> None:
+        pass
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline gazetteer index")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="Compile a GeoNames TSV into an index")
+    b.add_argument("tsv")
+    b.add_argument("--out", "-o", default=str(GAZETTEER_DIR))
+    b.add_argument("--min-population", type=int, default=0)
+
+    q = sub.add_parser("lookup", help="Look names up in a compiled index")
+    q.add_argument("index")
+    q.add_argument("names", nargs="+")
+    q.add_argument("--prefix", action="store_true", help="Prefix search")
+    q.add_argument("--country", action="append", help="Restrict to ISO code(s)")
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        t0 = time.perf_counter()
+        n = build_index(args.tsv, args.out, args.min_population)
+        print(f"✓  {n:,} places indexed → {args.out} ({time.perf_counter() - t0:.1f}s)")
+        sys.exit(0)
+
+    gaz = Gazetteer(args.index)
+    for name in args.names:
+        if args.prefix:
+            pids = gaz.prefix(name, countries=args.country)
+            print(f"{name}: " + ", ".join(f"{gaz.name(p)} ({int(gaz.population[p]):,})"
+                                         for p in pids))
+        else:
+            print(f"{name}: {gaz.lookup(name, args.country)}")
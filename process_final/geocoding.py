@@ -0,0 +1,136 @@
+"""
+Geocoding clients
+=================
+Concurrent, rate-limited Mapbox forward geocoding.
+
+  * one pooled ``requests.Session`` (keep-alive, shared TLS connections)
+  * a token-bucket limiter sized to the account quota
+  * retry with exponential backoff on 429 / 5xx (honours ``Retry-After``)
+  * results go through the persistent geocode cache (cache.py)
+
+``geocode_all`` fans a list of names out over a thread pool and returns the
+results in input order.  Point ``MAPBOX_GEOCODE`` at a local stub server to
+exercise the stage without network access or a real token.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import cached_geocode, normalize_query
+from metrics import metrics
+
+MAPBOX_TOKEN      = os.getenv("MAPBOX_TOKEN", "")
+MAPBOX_GEOCODE    = os.getenv("MAPBOX_GEOCODE",
+                              "https://api.mapbox.com/search/geocode/v6/forward")
+MAPBOX_RATE       = float(os.getenv("MAPBOX_RATE", "15"))   # requests / second (1000/min quota)
+MAPBOX_BURST      = int(os.getenv("MAPBOX_BURST", "15"))
+GEOCODE_WORKERS   = int(os.getenv("GEOCODE_WORKERS", "8"))
+GEOCODE_RETRIES   = 5
+GEOCODE_TIMEOUT   = 10
+RETRY_STATUSES    = {429, 500, 502, 503, 504}
+
+
+def retry_delay(response: requests.Response, default: float) -> float:
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        return default
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens/s, up to ``burst`` banked."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate     = rate
+        self.capacity = max(1, burst)
+        self._tokens  = float(self.capacity)
+        self._stamp   = time.monotonic()
+        self._lock    = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MapboxGeocoder:
+    provider = "mapbox"
+
+    def __init__(self, token: str = MAPBOX_TOKEN, url: str = MAPBOX_GEOCODE,
+                 rate: float = MAPBOX_RATE, burst: int = MAPBOX_BURST,
+                 workers: int = GEOCODE_WORKERS, retries: int = GEOCODE_RETRIES,
+                 backoff: float = 0.5):
+        self.token   = token
+        self.url     = url
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def lookup(self, name: str) -> tuple[float, float] | None:
+        """Query Mapbox; ``None`` means "no match", persistent errors raise."""
+        params = {"q": name, "limit": 1, "access_token": self.token}
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            try:
+                with metrics.timer("geocode_request_seconds", provider=self.provider):
+                    r = self.session.get(self.url, params=params, timeout=GEOCODE_TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                metrics.inc("geocode_retries_total", provider=self.provider)
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+            if r.status_code in RETRY_STATUSES and attempt < self.retries:
+                metrics.inc("geocode_retries_total", provider=self.provider)
+                time.sleep(retry_delay(r, self.backoff * 2 ** attempt))
+                continue
+            r.raise_for_status()
+            features = r.json().get("features", [])
+            if features:
+                coords = features[0]["geometry"]["coordinates"]  # [lon, lat]
+                return float(coords[0]), float(coords[1])
+            return None
+        return None
+
+    def geocode(self, name: str) -> tuple[float, float] | None:
+        """Cached lookup that reports (rather than raises) errors."""
+        try:
+            return cached_geocode(self.provider, name, self.lookup)
+        except Exception as e:
+            metrics.inc("geocode_errors_total", provider=self.provider)
+            print(f"    ⚠  Geocoding error for '{name}': {e}")
+            return None
+
+    def geocode_all(self, names: list[str]) -> list[tuple[float, float] | None]:
+        """Geocode ``names`` concurrently; results follow input order."""
+        # Identical queries (after normalization) are resolved once.
+        first: dict[str, str] = {}
+        for name in names:
+            first.setdefault(normalize_query(name), name)
+        keys = list(first)
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            resolved = dict(zip(keys, pool.map(self.geocode, (first[k] for k in keys))))
+        return [resolved[normalize_query(n)] for n in names]
+
+    def close(self) -> None:
+        self.session.close()
@@ -0,0 +1,94 @@
+"""
+Streaming GeoJSON writer
+========================
+Writes features to disk as soon as they are finished instead of building the
+whole FeatureCollection in memory.
+
+  collection  a regular FeatureCollection, byte-identical to
+              ``json.dumps(fc, ensure_ascii=False, indent=2)``; the closing
+              brackets are written by ``close()``
+  ndjson      newline-delimited GeoJSON, one Feature per line — valid after
+              every line, so ``tail -f <out>.tmp`` shows progress on long runs
+
+The format follows the file suffix (``.ndjson`` / ``.geojsonl`` / ``.jsonl``
+→ ndjson) unless given explicitly.
+
+Features go to ``<out>.tmp``, which ``close()`` renames over ``<out>``; a run
+that fails (``abort()``, or an exception inside ``with``) removes the temp
+file and leaves any previous output untouched.
+"""
+
+import json
+import os
+import textwrap
+from pathlib import Path
+
+NDJSON_SUFFIXES = {".ndjson", ".geojsonl", ".jsonl", ".geojsons"}
+
+
+def format_for(path: str | Path) -> str:
+    return "ndjson" if Path(path).suffix.lower() in NDJSON_SUFFIXES else "collection"
+
+
+class FeatureWriter:
+    def __init__(self, path: str | Path, fmt: str | None = None):
+        self.path  = Path(path)
+        self.fmt   = fmt or format_for(path)
+        if self.fmt not in ("collection", "ndjson"):
+            raise ValueError(f"Unknown GeoJSON output format: {self.fmt!r}")
+        self.count = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._fh = open(self.tmp_path, "w", encoding="utf-8")
+        if self.fmt == "collection":
+            self._fh.write('{\n  "type": "FeatureCollection",\n  "features": [')
+
+    def write(self, feature: dict) -> None:
+        if self.fmt == "ndjson":
+            self._fh.write(json.dumps(feature, ensure_ascii=False) + "\n")
+        else:
+            body = textwrap.indent(json.dumps(feature, ensure_ascii=False, indent=2), "    ")
+            self._fh.write(("," if self.count else "") + "\n" + body)
+        self.count += 1
+        self._fh.flush()
+
+    def write_all(self, features) -> int:
+        for feature in features:
+            self.write(feature)
+        return self.count
+
+    def close(self) -> None:
+        if self._fh.closed:
+            return
+        if self.fmt == "collection":
+            self._fh.write("\n  ]\n}" if self.count else "]\n}")
+        self._fh.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        """Drop the partial output; an existing file at ``path`` is kept."""
+        if self._fh.closed:
+            return
+        self._fh.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def read_features(path: str | Path):
+    """Yield the features of a FeatureCollection or ndjson file."""
+    path = Path(path)
+    with open(path, encoding="utf-8") as fh:
+        if format_for(path) == "ndjson":
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(fh).get("features", [])
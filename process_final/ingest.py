@@ -0,0 +1,232 @@
+"""
+EPUB / HTML ingestion
+=====================
+Turns ``.epub`` and ``.html`` books into (chapter title, plain text) pairs
+for the chunker, without ebooklib or BeautifulSoup.
+
+  * the EPUB is read with ``zipfile``; reading order comes from the OPF spine
+  * chapter titles come from the table of contents (nav / NCX), else the
+    first heading
+  * large books are parsed in a process pool, chapters yielded in spine order
+    as soon as each one is ready, with only a few chapters buffered ahead
+  * lxml is used when installed (much faster); otherwise the stdlib
+    ``html.parser`` does the same job
+
+Block elements become paragraph breaks ("\\n\\n") and whitespace inside a
+paragraph is collapsed, so the output chunks like the project's .txt files.
+"""
+
+import os
+import posixpath
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Iterator
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+try:
+    import lxml.html
+    HAVE_LXML = True
+except ImportError:
+    HAVE_LXML = False
+
+INGEST_WORKERS  = int(os.getenv("INGEST_WORKERS", str(min(8, os.cpu_count() or 1))))
+MARKUP_SUFFIXES = {".epub", ".html", ".htm", ".xhtml"}
+PARALLEL_BYTES  = int(os.getenv("INGEST_PARALLEL_BYTES", str(8 << 20)))   # uncompressed
+
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "body", "dd", "div", "dl", "dt",
+    "figcaption", "figure", "footer", "h1", "h2", "h3", "h4", "h5", "h6",
+    "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section", "table",
+    "td", "th", "tr", "ul",
+}
+SKIP_TAGS    = {"head", "script", "style", "template", "svg"}
+HEADING_TAGS = ("h1", "h2", "h3")
+
+_PARA_BREAK = re.compile(r"\n[ \t\r\f\v]*\n\s*")
+
+# =============================================================================
+# HTML → TEXT
+# =============================================================================
+
+def _normalize(raw: str) -> str:
+    paras = (" ".join(p.split()) for p in _PARA_BREAK.split(raw))
+    return "\n\n".join(p for p in paras if p)
+
+
+class _TextParser(HTMLParser):
+    """Stdlib fallback: collects text, marking block boundaries."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self.title   = ""
+        self.heading = ""
+        self._skip   = 0
+        self._in_title = self._in_heading = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n\n")
+        elif tag == "br":
+            self.parts.append("\n")
+        if tag in HEADING_TAGS and not self.heading:
+            self._in_heading = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n\n")
+        if tag in HEADING_TAGS:
+            self._in_heading = False
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        if self._skip:
+            return
+        if self._in_heading:
+            self.heading += data
+        self.parts.append(data)
+
+
+def _parse_stdlib(data: bytes) -> tuple[str, str]:
+    parser = _TextParser()
+    parser.feed(data.decode("utf-8", errors="replace"))
+    parser.close()
+    title = " ".join((parser.heading or parser.title).split())
+    return title, _normalize("".join(parser.parts))
+
+
+def _parse_lxml(data: bytes) -> tuple[str, str]:
+    root = lxml.html.fromstring(data)
+    title = ""
+    for tag in HEADING_TAGS + ("title",):
+        found = root.find(f".//{tag}")
+        if found is not None and found.text_content().strip():
+            title = " ".join(found.text_content().split())
+            break
+    for el in list(root.iter(*SKIP_TAGS)):
+        el.drop_tree()
+    for el in root.iter(*BLOCK_TAGS):
+        el.text = "\n\n" + (el.text or "")
+        el.tail = "\n\n" + (el.tail or "")
+    for el in root.iter("br"):
+        el.tail = "\n" + (el.tail or "")
+    return title, _normalize(root.text_content())
+
+
+def html_to_text(data: bytes) -> tuple[str, str]:
+    """(title, text) of one (X)HTML document; title is the first heading."""
+    return _parse_lxml(data) if HAVE_LXML else _parse_stdlib(data)
+
+# =============================================================================
+# EPUB
+# =============================================================================
+
+def _resolve(base: str, href: str) -> str:
+    return posixpath.normpath(posixpath.join(base, unquote(href.split("#", 1)[0])))
+
+
+def _toc_labels(zf: zipfile.ZipFile, opf, base: str, manifest: dict) -> dict[str, str]:
+    """Archive path → table-of-contents label, from the EPUB 3 nav or EPUB 2 NCX."""
+    labels: dict[str, str] = {}
+    nav = next((item for item in manifest.values()
+                if "nav" in (item.get("properties") or "").split()), None)
+    toc = nav if nav is not None else manifest.get(opf.find(".//{*}spine").get("toc"))
+    if toc is None:
+        return labels
+    toc_path = _resolve(base, toc.get("href"))
+    try:
+        root = ElementTree.fromstring(zf.read(toc_path))
+    except (KeyError, ElementTree.ParseError):
+        return labels
+    toc_base = posixpath.dirname(toc_path)
+    if nav is not None:
+        pairs = ((a.get("href"), "".join(a.itertext())) for a in root.iterfind(".//{*}nav//{*}a"))
+    else:
+        pairs = ((point.find("{*}content").get("src"), point.findtext("{*}navLabel/{*}text", ""))
+                 for point in root.iterfind(".//{*}navPoint")
+                 if point.find("{*}content") is not None)
+    for href, label in pairs:
+        label = " ".join(label.split())
+        if href and label:
+            labels.setdefault(_resolve(toc_base, href), label)
+    return labels
+
+
+def spine(zf: zipfile.ZipFile) -> list[tuple[str, str]]:
+    """(archive path, TOC label or "") of each (X)HTML document in reading order."""
+    container = ElementTree.fromstring(zf.read("META-INF/container.xml"))
+    opf_path  = container.find(".//{*}rootfile").get("full-path")
+    opf       = ElementTree.fromstring(zf.read(opf_path))
+    base      = posixpath.dirname(opf_path)
+    manifest  = {item.get("id"): item for item in opf.iterfind(".//{*}manifest/{*}item")}
+    labels    = _toc_labels(zf, opf, base, manifest)
+    docs = []
+    for ref in opf.iterfind(".//{*}spine/{*}itemref"):
+        item = manifest.get(ref.get("idref"))
+        if item is None or "html" not in item.get("media-type", ""):
+            continue
+        href = _resolve(base, item.get("href"))
+        docs.append((href, labels.get(href, "")))
+    return docs
+
+
+def _parse_member(path: str, href: str, label: str) -> tuple[str, str]:
+    with zipfile.ZipFile(path) as zf:
+        title, text = html_to_text(zf.read(href))
+    return label or title or Path(href).stem, text
+
+
+def iter_epub_chapters(path: str | Path, workers: int = INGEST_WORKERS) -> Iterator[tuple[str, str]]:
+    """
+    (title, text) for each non-empty spine document.  Books larger than
+    PARALLEL_BYTES are parsed in a process pool; below that, starting the
+    pool costs more than parsing serially.
+    """
+    with zipfile.ZipFile(path) as zf:
+        docs = spine(zf)
+        size = sum(zf.getinfo(href).file_size for href, _ in docs)
+    if workers <= 1 or size < PARALLEL_BYTES:
+        for href, label in docs:
+            title, text = _parse_member(str(path), href, label)
+            if text:
+                yield title, text
+        return
+    # "spawn": the caller may already be running LLM / geocoding threads.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        window: deque = deque()
+        for href, label in docs:
+            window.append(pool.submit(_parse_member, str(path), href, label))
+            if len(window) >= workers * 2:
+                title, text = window.popleft().result()
+                if text:
+                    yield title, text
+        while window:
+            title, text = window.popleft().result()
+            if text:
+                yield title, text
+
+
+def iter_chapters(path: str | Path) -> Iterator[tuple[str, str]]:
+    """(title, text) chapters of an .epub, or the single chapter of an .html file."""
+    path = Path(path)
+    if path.suffix.lower() == ".epub":
+        yield from iter_epub_chapters(path)
+    else:
+        title, text = html_to_text(path.read_bytes())
+        if text:
+            yield title or path.stem, text
@@ -0,0 +1,78 @@
+"""
+Extraction journal
+==================
+Durable, append-only record of per-chunk LLM extraction results, so a crash,
+Ctrl-C or OOM half-way through a book loses at most the chunk in flight.
+
+Each line of ``<out>.journal.jsonl`` is
+
+  {"chunk": "<sha256 of fingerprint + chunk text>", "locations": [...]}
+
+and is flushed and fsync'ed before the next chunk starts.  The fingerprint
+covers everything that changes the answer (model id, prompts, token limit),
+so editing the prompt invalidates old entries while editing part of the book
+only invalidates the chunks whose text changed.  A torn last line from an
+interrupted write is ignored on load.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+def journal_path_for(geojson_path: str | Path) -> Path:
+    p = Path(geojson_path)
+    return p.with_name(p.stem + ".journal.jsonl")
+
+
+class ExtractionJournal:
+    def __init__(self, path: str | Path, fingerprint: str, resume: bool = True):
+        self.path        = Path(path)
+        self.fingerprint = fingerprint
+        self._done: dict[str, list[dict]] = {}
+        if resume and self.path.exists():
+            with open(self.path, encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        rec = json.loads(line)
+                        self._done[rec["chunk"]] = rec["locations"]
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        continue
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = open(self.path, "a" if resume else "w", encoding="utf-8")
+        if resume and self._fh.tell() and not self.path.read_bytes().endswith(b"\n"):
+            self._fh.write("\n")   # terminate a torn final line
+        self.reused = 0
+
+    def key(self, chunk: str) -> str:
+        h = hashlib.sha256()
+        h.update(self.fingerprint.encode("utf-8") + b"\0" + chunk.encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, chunk: str) -> list[dict] | None:
+        """Journaled locations for ``chunk``, or None if it still needs the LLM."""
+        found = self._done.get(self.key(chunk))
+        if found is not None:
+            self.reused += 1
+        return found
+
+    def record(self, chunk: str, locations: list[dict]) -> None:
+        key = self.key(chunk)
+        self._done[key] = locations
+        self._fh.write(json.dumps({"chunk": key, "locations": locations},
+                                  ensure_ascii=False) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def close(self) -> None:
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,107 @@
+"""
+Incremental JSON for LLM replies
+================================
+The extraction prompt asks for one JSON array of objects, but models wrap it
+in prose, code fences, or keep talking afterwards.  Two helpers:
+
+  ArrayScanner   fed the reply as it streams; ``feed(text)`` turns True the
+                 moment the top-level array closes, so generation can stop
+                 instead of running on to ``max_tokens``
+  pull_json      pulls the answer out of a finished (or truncated) reply
+
+An array only counts when its first element is an object or it is empty
+(``[{`` / ``[]``), so prose such as "see [1]" is skipped.  Brackets inside
+strings are ignored.  A reply cut off mid-array still yields every element
+that was complete.
+"""
+
+import json
+import re
+
+_DECODER = json.JSONDecoder()
+_WS      = re.compile(r"\s*")
+
+
+class ArrayScanner:
+    """Character-level state machine over a streamed reply."""
+
+    def __init__(self):
+        self.done     = False
+        self._opened  = False   # saw "[", waiting for its first non-space char
+        self._depth   = 0
+        self._in_str  = False
+        self._escape  = False
+
+    def feed(self, text: str) -> bool:
+        """Consume the next piece of the reply; True once the array is closed."""
+        for c in text:
+            if self.done:
+                break
+            if self._depth:
+                self._step(c)
+            elif self._opened:
+                if c in "{]":
+                    self._opened, self._depth = False, 1
+                    self._step(c)
+                elif not c.isspace():
+                    self._opened = c == "["
+            elif c == "[":
+                self._opened = True
+        return self.done
+
+    def _step(self, c: str) -> None:
+        if self._in_str:
+            if self._escape:
+                self._escape = False
+            elif c == "\\":
+                self._escape = True
+            elif c == '"':
+                self._in_str = False
+        elif c == '"':
+            self._in_str = True
+        elif c in "[{":
+            self._depth += 1
+        elif c in "]}":
+            self._depth -= 1
+            if self._depth == 0:
+                self.done = True
+
+
+def _salvage(text: str, start: int) -> list:
+    """Complete elements of the array opening at ``text[start]``."""
+    items, pos = [], start + 1
+    while True:
+        pos = _WS.match(text, pos).end()
+        if pos >= len(text) or text[pos] == "]":
+            return items
+        try:
+            item, pos = _DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return items
+        items.append(item)
+        pos = _WS.match(text, pos).end()
+        if text.startswith(",", pos):
+            pos += 1
+
+
+def pull_json(text: str):
+    """
+    The first JSON array of objects in ``text`` (partial if the reply was
+    truncated), else the first JSON object, else ``[]``.
+    """
+    partial = None
+    for m in re.finditer(r"\[\s*[{\]]", text):
+        try:
+            found, _ = _DECODER.raw_decode(text, m.start())
+            return found
+        except json.JSONDecodeError:
+            if partial is None:
+                partial = _salvage(text, m.start())
+    if partial:
+        return partial
+    for m in re.finditer(r"\{", text):
+        try:
+            return _DECODER.raw_decode(text, m.start())[0]
+        except json.JSONDecodeError:
+            continue
+    return []
@@ -0,0 +1,206 @@
+"""
+LLM backends
+============
+``extract_from_chunk`` talks to the model through a tiny interface:
+
+  backend.model_id                       identity used for cache keys
+  backend.max_in_flight                  how many requests may run at once
+  backend.generate(messages, max_tokens, sampling, usage=None,
+                   stop=None, schema=None) -> str
+
+``usage``, when given, is filled with prompt_tokens / completion_tokens (and
+``stopped`` when generation was cut short).  Replies are streamed: ``stop``
+is called with each new piece of text and ends generation as soon as it
+returns True (see jsonstream.ArrayScanner).  ``schema`` is a JSON Schema the
+reply must follow; the OpenAI backend sends it as ``response_format`` so the
+server can constrain decoding, mlx-lm has no grammar support and ignores it.
+
+Two implementations:
+
+  MLXBackend     in-process mlx-lm (Apple Silicon), one prompt at a time
+  OpenAIBackend  any OpenAI-compatible ``/v1/chat/completions`` server
+                 (llama.cpp ``llama-server``, vLLM, …).  Requests share a
+                 pooled session and are issued concurrently so the server can
+                 batch them continuously.
+
+``generate_many`` fans a list of prompts out over ``max_in_flight`` threads;
+``imap_ordered`` does the same for an unbounded iterator, keeping at most
+``depth`` items in flight so a streamed book never piles up in memory.
+"""
+
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from geocoding import RETRY_STATUSES, retry_delay
+from models import load_qwen, registry
+
+LLM_URL       = os.getenv("LLM_URL", "http://127.0.0.1:8080/v1")
+LLM_API_KEY   = os.getenv("LLM_API_KEY", "")
+LLM_INFLIGHT  = int(os.getenv("LLM_INFLIGHT", "4"))
+LLM_TIMEOUT   = float(os.getenv("LLM_TIMEOUT", "600"))
+LLM_STREAM    = os.getenv("LLM_STREAM", "1") != "0"   # stream replies (enables early stop)
+
+
+class MLXBackend:
+    max_in_flight = 1   # mlx-lm generation is not re-entrant
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        registry.register("qwen", lambda: load_qwen(model_id))
+
+    def generate(self, messages: list[dict], max_tokens: int, sampling: dict,
+                 usage: dict | None = None, stop: Callable | None = None,
+                 schema: dict | None = None) -> str:
+        from mlx_lm import stream_generate
+        model, tok = registry.get("qwen")
+        prompt = tok.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+        extra = {}
+        if sampling.get("temp", 0) > 0:
+            from mlx_lm.sample_utils import make_sampler
+            extra["sampler"] = make_sampler(sampling["temp"], sampling.get("top_p", 1.0))
+        pieces, stopped = [], False
+        for step in stream_generate(model, tok, prompt=prompt, max_tokens=max_tokens, **extra):
+            piece = getattr(step, "text", step)   # GenerationResponse (or str, older mlx-lm)
+            pieces.append(piece)
+            if stop is not None and stop(piece):
+                stopped = True
+                break
+        out = "".join(pieces)
+        if usage is not None:
+            usage["prompt_tokens"]     = len(tok.encode(prompt))
+            usage["completion_tokens"] = len(pieces)
+            usage["stopped"]           = stopped
+        return out
+
+
+class OpenAIBackend:
+    def __init__(self, model_id: str, url: str = LLM_URL, api_key: str = LLM_API_KEY,
+                 max_in_flight: int = LLM_INFLIGHT, retries: int = 4,
+                 backoff: float = 1.0, timeout: float = LLM_TIMEOUT,
+                 stream: bool = LLM_STREAM):
+        self.model_id      = model_id
+        self.url           = url.rstrip("/") + "/chat/completions"
+        self.max_in_flight = max(1, max_in_flight)
+        self.retries       = retries
+        self.backoff       = backoff
+        self.timeout       = timeout
+        self.stream        = stream
+        self.session       = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def generate(self, messages: list[dict], max_tokens: int, sampling: dict,
+                 usage: dict | None = None, stop: Callable | None = None,
+                 schema: dict | None = None) -> str:
+        body = {
+            "model":       self.model_id,
+            "messages":    messages,
+            "max_tokens":  max_tokens,
+            "temperature": sampling.get("temp", 0.0),
+            "top_p":       sampling.get("top_p", 1.0),
+        }
+        if schema is not None:
+            body["response_format"] = {"type": "json_schema",
+                                       "json_schema": {"name": "reply", "schema": schema}}
+        if self.stream:
+            body["stream"]         = True
+            body["stream_options"] = {"include_usage": True}
+        for attempt in range(self.retries + 1):
+            try:
+                r = self.session.post(self.url, json=body, timeout=self.timeout,
+                                      stream=self.stream)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+            if r.status_code in RETRY_STATUSES and attempt < self.retries:
+                time.sleep(retry_delay(r, self.backoff * 2 ** attempt))
+                continue
+            r.raise_for_status()
+            if "text/event-stream" in r.headers.get("Content-Type", ""):
+                return self._read_stream(r, usage, stop)
+            data = r.json()
+            if usage is not None:
+                usage.update({k: v for k, v in (data.get("usage") or {}).items()
+                              if k in ("prompt_tokens", "completion_tokens")})
+            return data["choices"][0]["message"]["content"] or ""
+        return ""
+
+    @staticmethod
+    def _read_stream(r: requests.Response, usage: dict | None, stop: Callable | None) -> str:
+        """Collect server-sent deltas; closing the response early aborts generation."""
+        pieces, stopped = [], False
+        with r:
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                event = json.loads(payload)
+                if usage is not None and event.get("usage"):
+                    usage.update({k: v for k, v in event["usage"].items()
+                                  if k in ("prompt_tokens", "completion_tokens")})
+                piece = "".join((choice.get("delta") or {}).get("content") or ""
+                                for choice in event.get("choices") or ())
+                if not piece:
+                    continue
+                pieces.append(piece)
+                if stop is not None and stop(piece):
+                    stopped = True
+                    break
+        if usage is not None:
+            usage.setdefault("completion_tokens", len(pieces))   # ~one token per delta
+            usage["stopped"] = stopped
+        return "".join(pieces)
+
+
+def make_backend(kind: str, model_id: str):
+    if kind == "mlx":
+        return MLXBackend(model_id)
+    if kind == "openai":
+        return OpenAIBackend(model_id)
+    raise ValueError(f"Unknown LLM backend: {kind!r} (expected 'mlx' or 'openai')")
+
+
+def generate_many(fn: Callable, items: list, depth: int) -> list:
+    """``[fn(x) for x in items]`` with up to ``depth`` calls in flight, in input order."""
+    if depth <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+        return list(pool.map(fn, items))
+
+
+def imap_ordered(fn: Callable, items: Iterable, depth: int) -> Iterator[tuple]:
+    """
+    Lazily yield ``(item, fn(item))`` in input order with up to ``depth`` calls
+    in flight.  ``items`` is only pulled as slots free up (in the caller's
+    thread), so memory is bounded by ``depth`` regardless of input length.
+    """
+    if depth <= 1:
+        for item in items:
+            yield item, fn(item)
+        return
+    window: deque = deque()
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+        for item in items:
+            window.append((item, pool.submit(fn, item)))
+            if len(window) >= depth:
+                done, fut = window.popleft()
+                yield done, fut.result()
+        while window:
+            done, fut = window.popleft()
+            yield done, fut.result()
@@ -0,0 +1,182 @@
+"""
+Run metrics
+===========
+A small in-process metrics registry shared by the pipeline stages, exported
+as a JSON run report or in the Prometheus text exposition format.
+
+  metrics.inc("chunks_total")                      counter
+  metrics.set("mentions_unique", 412)              gauge
+  metrics.observe("llm_latency_seconds", 1.8)      summary (p50 / p90 / p99)
+  with metrics.timer("stage_seconds", stage="geocode"):
+      ...                                          summary of wall time
+
+Labels are keyword arguments.  Everything is thread-safe, so helpers running
+in LLM / geocoding worker threads can record directly.
+"""
+
+import json
+import math
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def peak_rss_bytes() -> int | None:
+    """Peak resident set size of this process (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024   # Linux reports KiB
+
+
+def _quantile(ordered: list[float], q: float) -> float:
+    """Nearest-rank quantile of an already sorted list."""
+    rank = math.ceil(q * len(ordered) - 1e-9)   # tolerate 0.1 * 30 = 3.0000000000000004
+    return ordered[min(len(ordered) - 1, max(0, rank - 1))]
+
+
+def _label_str(labels: tuple) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters: dict[tuple, float] = {}
+            self.gauges:   dict[tuple, float] = {}
+            self.samples:  dict[tuple, list[float]] = {}
+            self.started   = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self.samples.setdefault(key, []).append(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    # ── reading ──────────────────────────────────────────────────────────────
+
+    def counter(self, name: str, **labels) -> float:
+        return self.counters.get(self._key(name, labels), 0)
+
+    def gauge(self, name: str, **labels) -> float | None:
+        return self.gauges.get(self._key(name, labels))
+
+    def summary(self, name: str, **labels) -> dict:
+        with self._lock:
+            values = sorted(self.samples.get(self._key(name, labels), []))
+        if not values:
+            return {"count": 0, "sum": 0.0}
+        out = {"count": len(values), "sum": round(sum(values), 6),
+               "mean": round(sum(values) / len(values), 6), "max": round(values[-1], 6)}
+        for q in QUANTILES:
+            out[f"p{int(q * 100)}"] = round(_quantile(values, q), 6)
+        return out
+
+    def snapshot(self) -> dict:
+        """All metrics as plain JSON-able data, plus peak RSS and uptime."""
+        def flat(key: tuple) -> str:
+            name, labels = key
+            return f"{name}{{{_label_str(labels)}}}" if labels else name
+
+        with self._lock:
+            counters = {flat(k): v for k, v in sorted(self.counters.items())}
+            gauges   = {flat(k): v for k, v in sorted(self.gauges.items())}
+            keys     = sorted(self.samples)
+        return {
+            "started":        self.started,
+            "elapsed_s":      round(time.time() - self.started, 3),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "counters":       counters,
+            "gauges":         gauges,
+            "summaries":      {flat(k): self.summary(k[0], **dict(k[1])) for k in keys},
+        }
+
+    # ── export ───────────────────────────────────────────────────────────────
+
+    def to_prometheus(self, prefix: str = "litgeo_") -> str:
+        """Prometheus text exposition format (counters, gauges, summaries)."""
+        lines: list[str] = []
+        typed: set[str] = set()
+
+        def emit(kind: str, name: str, labels: tuple, value: float, suffix: str = "",
+                 extra: tuple = ()) -> None:
+            metric = prefix + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} {kind}")
+                typed.add(metric)
+            label = _label_str(labels + extra)
+            lines.append(f"{metric}{suffix}{{{label}}} {value}" if label
+                         else f"{metric}{suffix} {value}")
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges   = sorted(self.gauges.items())
+            keys     = sorted(self.samples)
+        for (name, labels), value in counters:
+            emit("counter", name, labels, value)
+        for (name, labels), value in gauges:
+            emit("gauge", name, labels, value)
+        rss = peak_rss_bytes()
+        if rss is not None:
+            emit("gauge", "peak_rss_bytes", (), rss)
+        for name, labels in keys:
+            stats = self.summary(name, **dict(labels))
+            for q in QUANTILES:
+                emit("summary", name, labels, stats[f"p{int(q * 100)}"],
+                     extra=(("quantile", str(q)),))
+            emit("summary", name, labels, stats["sum"], "_sum")
+            emit("summary", name, labels, stats["count"], "_count")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str | Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(self.to_prometheus(), encoding="utf-8")
+
+
+metrics = Metrics()
+
+
+def metrics_path_for(geojson_path: str | Path) -> Path:
+    """``out/book.geojson`` → ``out/book.metrics.json``"""
+    p = Path(geojson_path)
+    return p.with_name(p.stem + ".metrics.json")
+
+
+def write_report(path: str | Path, report: dict) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
@@ -0,0 +1,77 @@
+"""
+Lazy model registry
+===================
+Heavy models are registered by name with a zero-argument factory and are only
+built the first time ``registry.get(name)`` is called.  Importing the pipeline
+therefore costs nothing; a run that never reaches the LLM or the embedder
+(``--help``, bad arguments, geocoding-only work) never loads them.
+
+  registry.register("bge", lambda: load_bge("BAAI/bge-m3"))
+  model = registry.get("bge")          # loads on first use, then cached
+"""
+
+import threading
+import time
+from typing import Any, Callable
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._factories: dict[str, Callable[[], Any]] = {}
+        self._instances: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        self._factories[name] = factory
+
+    def get(self, name: str) -> Any:
+        if name in self._instances:
+            return self._instances[name]
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._factories:
+                    raise KeyError(f"No model registered as {name!r}")
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def preload(self, *names: str) -> None:
+        for name in names or tuple(self._factories):
+            self.get(name)
+
+    def unload(self, name: str) -> None:
+        with self._lock:
+            self._instances.pop(name, None)
+
+
+registry = ModelRegistry()
+
+# =============================================================================
+# LOADERS
+# =============================================================================
+
+def load_qwen(model_id: str):
+    """(model, tokenizer) for an MLX chat model."""
+    from mlx_lm import load
+    print(f"⏳  Loading {model_id} (MLX)…", flush=True)
+    t0 = time.perf_counter()
+    model, tok = load(model_id)
+    print(f"✓   LLM ready ({time.perf_counter() - t0:.1f}s)", flush=True)
+    return model, tok
+
+
+def load_bge(model_id: str):
+    from sentence_transformers import SentenceTransformer
+    print(f"⏳  Loading {model_id}…", flush=True)
+    t0 = time.perf_counter()
+    model = SentenceTransformer(model_id)
+    print(f"✓   Embedder ready ({time.perf_counter() - t0:.1f}s)", flush=True)
+    return model
+
+
+def load_tokenizer(model_id: str):
+    """Tokenizer only (no weights) — used to measure chunks in tokens."""
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_id)
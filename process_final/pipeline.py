@@ -2,52 +2,102 @@
 """
 Literary Geography Pipeline
 ============================
-Input  : plain .txt file (English or Chinese)
-Output : GeoJSON matching the output_final.geojson schema
+Input  : plain .txt file (English or Chinese), or an .epub / .html book
+Output : GeoJSON matching the output_final.geojson schema, streamed to disk
+         as a FeatureCollection or newline-delimited GeoJSON
 
 Stack
 -----
   Qwen2.5-14B  via mlx-lm       → location extraction + sentiment
+               or any OpenAI-compatible server (LLM_BACKEND=openai, LLM_URL)
   BGE-M3       via FlagEmbedding → topic + theme classification
   Mapbox Geocoding API           → geocoding (set MAPBOX_TOKEN env var)
+  SQLite geocode cache           → .cache/geocode.sqlite (PIPELINE_CACHE_DIR)
+  LLM response cache             → .cache/llm.sqlite (LLM_CACHE=0 disables)
+  Embedding store                → .cache/embeddings/ (EMBED_CACHE=0 disables)
+  Offline gazetteer (optional)   → --geocoder gazetteer (see gazetteer.py)
+  Region filter (optional)       → REGIONS_FILE + REGION_FILTER (see regions.py)
 
 Usage
 -----
   export MAPBOX_TOKEN="pk.eyJ1..."
   python pipeline.py my_book.txt
   python pipeline.py my_book.txt --source "My Novel" --out result.geojson
+  python pipeline.py my_book.txt --geocoder gazetteer   # no network / token
+  python pipeline.py my_book.epub               # chapters parsed natively
+  python pipeline.py my_book.txt --resume       # continue an interrupted run
+  python pipeline.py my_book.txt --prefilter    # skip chunks with no place candidates
+  python pipeline.py my_book.txt -o out.ndjson  # newline-delimited, tail -f friendly
+  python pipeline.py my_book.txt --prometheus run.prom  # + <out>.metrics.json report
+  LLM_BACKEND=openai LLM_URL=http://127.0.0.1:8080/v1 LLM_INFLIGHT=8 \
+      python pipeline.py my_book.txt             # llama.cpp / vLLM server
+
+  python pipeline.py --serve &                  # warm worker, models stay loaded
+  python pipeline.py my_book.txt --worker       # run the job inside the worker
+      (a 0600 Unix socket; the key is $PIPELINE_WORKER_KEY or .cache/worker.key)
+  python batch.py books/ --out-dir out/          # whole corpus, models loaded once
 """
 
 import argparse
 import json
+import ipaddress
 import os
-import re
+import secrets
+import socket
 import sys
+import time
 from pathlib import Path
 
 import numpy as np
-import requests
 
-# ── Local LLM (Qwen2.5 14B via MLX) ─────────────────────────────────────────
-from mlx_lm import load, generate as mlx_generate
-
-# ── Embeddings (BGE-M3 via sentence-transformers) ────────────────────────────
-from sentence_transformers import SentenceTransformer
+from cache import CACHE_DIR, MISS, geocode_cache, llm_cache, llm_key
+from canonical import canonicalize
+from chunking import (CHUNK_SIZE, chunk_text, drop_repeats, iter_chunks,
+                      iter_file_paragraphs, iter_paragraphs, iter_token_chunks,
+                      with_offsets)
+from embedstore import EmbeddingStore
+from gazetteer import GAZETTEER_DIR, GazetteerGeocoder
+from geocoding import MapboxGeocoder
+from geojson_stream import FeatureWriter
+from ingest import MARKUP_SUFFIXES, iter_chapters
+from journal import ExtractionJournal, journal_path_for
+from jsonstream import ArrayScanner, pull_json
+from llm import imap_ordered, make_backend
+from metrics import metrics, metrics_path_for, peak_rss_bytes, write_report
+from models import load_bge, load_tokenizer, registry
+from prefilter import has_place_candidate
+from regions import region_filter
+from rethreshold import save_scores, scores_path_for
 
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
 
 QWEN_MODEL_ID   = "mlx-community/Qwen2.5-14B-Instruct-4bit"
+LLM_BACKEND     = os.getenv("LLM_BACKEND", "mlx")        # "mlx" | "openai"
+LLM_MODEL_ID    = os.getenv("LLM_MODEL", QWEN_MODEL_ID)  # model name sent to the server
 BGE_MODEL_ID    = "BAAI/bge-m3"
 
 MAPBOX_TOKEN    = os.getenv("MAPBOX_TOKEN", "")
-MAPBOX_GEOCODE  = "https://api.mapbox.com/search/geocode/v6/forward"
-
-CHUNK_SIZE      = 1600   # characters per LLM call (fits ~400 tokens of context)
+MAPBOX_GEOCODE  = os.getenv("MAPBOX_GEOCODE",
+                            "https://api.mapbox.com/search/geocode/v6/forward")
+GEOCODER        = os.getenv("GEOCODER", "mapbox")   # "mapbox" | "gazetteer"
+GAZETTEER_DIR   = os.getenv("GAZETTEER_DIR", str(GAZETTEER_DIR))
+
+CHUNK_TOKENS    = int(os.getenv("CHUNK_TOKENS", "1024"))  # token budget per chunk (0 = CHUNK_SIZE chars)
+CHUNK_OVERLAP   = int(os.getenv("CHUNK_OVERLAP", "0"))    # tokens repeated between chunks
+LLM_CONTEXT     = 32768  # Qwen2.5 context window (prompt + generation)
+TOKENIZER_ID    = os.getenv("TOKENIZER_ID", QWEN_MODEL_ID)
 MAX_LLM_TOKENS  = 900    # max tokens Qwen may generate per chunk
+LLM_SAMPLING    = {"temp": 0.0, "top_p": 1.0}   # greedy decoding (mlx-lm default)
+LLM_JSON_SCHEMA = os.getenv("LLM_JSON_SCHEMA", "0") == "1"   # server-side constrained decoding
+LLM_CACHE       = os.getenv("LLM_CACHE", "1") != "0"   # reuse identical generations
+PREFILTER       = os.getenv("PREFILTER", "0") == "1"   # skip place-free chunks
 TOPIC_THRESHOLD = 0.38   # cosine similarity cutoff for topic classification
 THEME_THRESHOLD = 0.33   # cosine similarity cutoff for theme classification
+EMBED_BATCH     = 64     # contexts per BGE-M3 forward pass
+CLASSIFY_BATCH  = 1024   # contexts classified (and features emitted) per step
+EMBED_CACHE     = os.getenv("EMBED_CACHE", "1") != "0"   # reuse stored vectors
 
 # =============================================================================
 # TOPIC & THEME SEED DESCRIPTIONS  (used for BGE-M3 similarity)
@@ -81,69 +131,87 @@ THEME_SEEDS = {
 }
 
 # =============================================================================
-# MODEL LOADING  (happens once at import / startup)
+# MODEL LOADING  (lazy — nothing is loaded until a stage first needs it)
 # =============================================================================
 
-print("⏳  Loading Qwen2.5-14B (MLX)…", flush=True)
-_qwen_model, _qwen_tok = load(QWEN_MODEL_ID)
-print("✓   Qwen2.5-14B ready", flush=True)
+registry.register("bge",  lambda: load_bge(BGE_MODEL_ID))
+registry.register("tokenizer", lambda: load_tokenizer(TOKENIZER_ID))
 
-print("⏳  Loading BGE-M3…", flush=True)
-_bge = SentenceTransformer(BGE_MODEL_ID)
-print("✓   BGE-M3 ready", flush=True)
+_embed_store = EmbeddingStore(BGE_MODEL_ID) if EMBED_CACHE else None
 
-# Pre-encode seed descriptions once
-print("⏳  Pre-computing seed embeddings…", flush=True)
 _topic_keys   = list(TOPIC_SEEDS.keys())
 _theme_keys   = list(THEME_SEEDS.keys())
-_topic_vecs   = _bge.encode(list(TOPIC_SEEDS.values()), normalize_embeddings=True)
-_theme_vecs   = _bge.encode(list(THEME_SEEDS.values()), normalize_embeddings=True)
-print("✓   Embeddings ready\n", flush=True)
+_seed_vecs: tuple[np.ndarray, np.ndarray] | None = None
+
+
+def _bge_encode(texts: list[str]) -> np.ndarray:
+    model = registry.get("bge")
+    with metrics.timer("embed_seconds"):
+        vecs = model.encode(texts, batch_size=EMBED_BATCH,
+                            normalize_embeddings=True, convert_to_numpy=True)
+    metrics.inc("embed_texts_total", len(texts))
+    return vecs
+
+
+def embed(texts: list[str]) -> np.ndarray:
+    """Normalized BGE-M3 vectors, reusing the on-disk store when enabled."""
+    if _embed_store is None:
+        return _bge_encode(texts)
+    return _embed_store.encode(texts, _bge_encode)
+
+
+def seed_vectors() -> tuple[np.ndarray, np.ndarray]:
+    """Topic and theme seed matrices, encoded on first use (edited seeds only)."""
+    global _seed_vecs
+    if _seed_vecs is None:
+        _seed_vecs = (embed(list(TOPIC_SEEDS.values())),
+                      embed(list(THEME_SEEDS.values())))
+    return _seed_vecs
 
 # =============================================================================
 # UTILITIES
 # =============================================================================
 
-def cosine(a: np.ndarray, b: np.ndarray) -> float:
-    denom = np.linalg.norm(a) * np.linalg.norm(b)
-    return float(np.dot(a, b) / (denom + 1e-9))
-
-
-def chunk_text(text: str, size: int = CHUNK_SIZE) -> list[str]:
-    """Split on paragraph breaks; keep each chunk under `size` characters."""
-    paras = [p.strip() for p in re.split(r"\n{2,}", text) if p.strip()]
-    chunks, current = [], ""
-    for para in paras:
-        if len(current) + len(para) > size and current:
-            chunks.append(current.strip())
-            current = para + "\n\n"
-        else:
-            current += para + "\n\n"
-    if current.strip():
-        chunks.append(current.strip())
-    return chunks
+_llm = None
 
 
-def pull_json(text: str):
-    """Extract the first JSON array (or object) from a string."""
-    for pattern in (r"\[[\s\S]*?\]", r"\{[\s\S]*?\}"):
-        m = re.search(pattern, text)
-        if m:
-            try:
-                return json.loads(m.group())
-            except json.JSONDecodeError:
-                pass
-    return []
+def get_llm():
+    """The configured LLM backend (see llm.py); created on first use."""
+    global _llm
+    if _llm is None:
+        _llm = make_backend(LLM_BACKEND, LLM_MODEL_ID)
+    return _llm
 
 
-def run_qwen(user: str, system: str, max_tokens: int = MAX_LLM_TOKENS) -> str:
+def run_qwen(user: str, system: str, max_tokens: int = MAX_LLM_TOKENS,
+             schema: dict | None = None) -> str:
+    """
+    One chat completion.  With ``schema`` (a JSON array schema) generation
+    stops as soon as the reply's top-level array closes, and the schema is
+    sent to the server when LLM_JSON_SCHEMA=1.
+    """
     messages = [{"role": "system", "content": system},
                 {"role": "user",   "content": user}]
-    prompt = _qwen_tok.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=True
-    )
-    return mlx_generate(_qwen_model, _qwen_tok,
-                        prompt=prompt, max_tokens=max_tokens, verbose=False)
+    llm      = get_llm()
+    stop     = ArrayScanner().feed if schema is not None else None
+    schema   = schema if LLM_JSON_SCHEMA else None
+    sampling = {**LLM_SAMPLING, "schema": schema} if schema else LLM_SAMPLING
+    if LLM_CACHE:
+        key    = llm_key(llm.model_id, messages, max_tokens, sampling)
+        cached = llm_cache().get(key)
+        if cached is not MISS:
+            metrics.inc("llm_cache_hits_total")
+            return cached
+    usage: dict = {}
+    with metrics.timer("llm_latency_seconds"):
+        out = llm.generate(messages, max_tokens, LLM_SAMPLING, usage, stop=stop, schema=schema)
+    metrics.inc("llm_requests_total")
+    metrics.inc("llm_early_stops_total", bool(usage.get("stopped")))
+    metrics.inc("llm_prompt_tokens_total", usage.get("prompt_tokens") or 0)
+    metrics.inc("llm_completion_tokens_total", usage.get("completion_tokens") or 0)
+    if LLM_CACHE:
+        llm_cache().set(key, out)
+    return out
 
 # =============================================================================
 # STEP 1 — LOCATION EXTRACTION  (Qwen2.5)
@@ -172,10 +240,25 @@ Rules:
 
 JSON:"""
 
+EXTRACT_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "name":      {"type": "string"},
+            "context":   {"type": "string"},
+            "sentiment": {"enum": ["positive", "negative", "neutral"]},
+        },
+        "required": ["name", "context", "sentiment"],
+    },
+}
+
 
 def extract_from_chunk(chunk: str) -> list[dict]:
-    raw     = run_qwen(_EXTRACT_TPL.format(chunk=chunk), _EXTRACT_SYS)
+    raw     = run_qwen(_EXTRACT_TPL.format(chunk=chunk), _EXTRACT_SYS, schema=EXTRACT_SCHEMA)
     results = pull_json(raw)
+    if isinstance(results, dict):   # {"locations": [...]}-style wrapper
+        results = next((v for v in results.values() if isinstance(v, list)), [])
     if not isinstance(results, list):
         return []
     clean = []
@@ -190,101 +273,604 @@ def extract_from_chunk(chunk: str) -> list[dict]:
                           "sentiment": sent if sent in ("positive","negative","neutral") else "neutral"})
     return clean
 
+
+def count_tokens(text: str) -> int:
+    return len(registry.get("tokenizer").encode(text, add_special_tokens=False))
+
+
+def chunk_budget() -> int:
+    """CHUNK_TOKENS, capped so prompt + chunk + generation fit LLM_CONTEXT."""
+    overhead = count_tokens(_EXTRACT_SYS + _EXTRACT_TPL.format(chunk="")) + 32   # chat markup
+    return max(64, min(CHUNK_TOKENS, LLM_CONTEXT - MAX_LLM_TOKENS - overhead))
+
+
+def _packer():
+    """Paragraphs → chunks: token packing (CHUNK_TOKENS > 0) or the character fallback."""
+    if CHUNK_TOKENS > 0:
+        try:
+            budget = chunk_budget()
+            return lambda paras: iter_token_chunks(paras, count_tokens, budget, CHUNK_OVERLAP)
+        except ImportError:
+            print("    ⚠  transformers not installed — falling back to character chunks")
+        except OSError as e:   # offline, or the tokenizer repo cannot be reached
+            print(f"    ⚠  Tokenizer unavailable ({e}) — falling back to character chunks")
+    return lambda paras: iter_chunks(paras, CHUNK_SIZE)
+
+
+def iter_source_chunks(source: str | Path):
+    """
+    Lazily yield ``(chunk, meta)`` for ``source``: a text string, a .txt Path
+    read through a memory map, or an .epub / .html Path.  Markup books are
+    chunked chapter by chapter (chunks never straddle chapters) and ``meta``
+    carries the chapter title, its spine index and the chunk's character
+    offset within the chapter; plain text has empty ``meta``.
+    """
+    pack = _packer()
+    if isinstance(source, Path) and source.suffix.lower() in MARKUP_SUFFIXES:
+        for index, (title, text) in enumerate(iter_chapters(source)):
+            for chunk, offset in with_offsets(text, pack(iter_paragraphs(text))):
+                yield chunk, {"chapter": title, "chapter_index": index, "offset": offset}
+        return
+    paragraphs = (iter_file_paragraphs(source) if isinstance(source, Path)
+                  else iter_paragraphs(source))
+    for chunk in pack(paragraphs):
+        yield chunk, {}
+
+
+def make_chunks(text: str) -> list[str]:
+    """Token-packed chunks (CHUNK_TOKENS > 0) or the character-based fallback."""
+    return [chunk for chunk, _ in iter_source_chunks(text)]
+
 # =============================================================================
 # STEP 2 — TOPIC + THEME CLASSIFICATION  (BGE-M3 cosine similarity)
 # =============================================================================
 
+def _labels(keys: list[str], row: np.ndarray) -> dict:
+    return {k: bool(v) for k, v in zip(keys, row)}
+
+
+def score_batch(contexts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Raw cosine similarities of many contexts against the topic and theme seeds.
+
+    Identical contexts are encoded once, in batches of EMBED_BATCH; the
+    normalized vectors are scored against the stacked seed matrices with a
+    single matrix multiply.  Row i of each matrix belongs to contexts[i].
+    """
+    if not contexts:
+        return (np.zeros((0, len(_topic_keys)), dtype=np.float32),
+                np.zeros((0, len(_theme_keys)), dtype=np.float32))
+    index: dict[str, int] = {}
+    rows = np.array([index.setdefault(c, len(index)) for c in contexts])
+    topic_vecs, theme_vecs = seed_vectors()
+    vecs = embed(list(index))[rows]
+    return vecs @ topic_vecs.T, vecs @ theme_vecs.T
+
+
+def classify_batch(contexts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Boolean topic and theme tables (rows follow ``contexts``)."""
+    topic_scores, theme_scores = score_batch(contexts)
+    return topic_scores >= TOPIC_THRESHOLD, theme_scores >= THEME_THRESHOLD
+
+
 def classify(context: str) -> tuple[dict, dict]:
     """Return topics dict and themes dict for a single context sentence."""
-    vec = _bge.encode([context], normalize_embeddings=True)[0]
-
-    topics = {k: bool(cosine(vec, _topic_vecs[i]) >= TOPIC_THRESHOLD)
-              for i, k in enumerate(_topic_keys)}
-    themes = {k: bool(cosine(vec, _theme_vecs[i]) >= THEME_THRESHOLD)
-              for i, k in enumerate(_theme_keys)}
-    return topics, themes
+    topic_tab, theme_tab = classify_batch([context])
+    return _labels(_topic_keys, topic_tab[0]), _labels(_theme_keys, theme_tab[0])
 
 # =============================================================================
-# STEP 3 — GEOCODING  (Mapbox Geocoding API v6)
+# STEP 3 — GEOCODING  (Mapbox Geocoding API v6 or offline gazetteer)
 # =============================================================================
 
+_geocoder: MapboxGeocoder | GazetteerGeocoder | None = None
+
+
+def get_geocoder() -> MapboxGeocoder | GazetteerGeocoder | None:
+    """The configured geocoder backend, or None if it cannot be used."""
+    global _geocoder
+    if _geocoder is None:
+        if GEOCODER == "gazetteer":
+            _geocoder = GazetteerGeocoder(GAZETTEER_DIR)
+        elif not MAPBOX_TOKEN:
+            print("    ⚠  MAPBOX_TOKEN not set — skipping geocode")
+            return None
+        else:
+            _geocoder = MapboxGeocoder(MAPBOX_TOKEN, MAPBOX_GEOCODE)
+    return _geocoder
+
+
 def geocode(name: str) -> tuple[float, float] | None:
-    if not MAPBOX_TOKEN:
-        print("    ⚠  MAPBOX_TOKEN not set — skipping geocode")
-        return None
-    try:
-        r = requests.get(
-            MAPBOX_GEOCODE,
-            params={"q": name, "limit": 1, "access_token": MAPBOX_TOKEN},
-            timeout=10,
-        )
-        r.raise_for_status()
-        features = r.json().get("features", [])
-        if features:
-            coords = features[0]["geometry"]["coordinates"]  # [lon, lat]
-            return float(coords[0]), float(coords[1])
-    except Exception as e:
-        print(f"    ⚠  Geocoding error for '{name}': {e}")
-    return None
+    """Geocode one name with the configured backend."""
+    geocoder = get_geocoder()
+    return geocoder.geocode(name) if geocoder else None
+
+
+def geocode_all(names: list[str]) -> list[tuple[float, float] | None]:
+    """Geocode many names (concurrently for Mapbox); results follow input order."""
+    geocoder = get_geocoder()
+    return geocoder.geocode_all(names) if geocoder else [None] * len(names)
 
 # =============================================================================
 # MAIN PIPELINE
 # =============================================================================
 
-def process(text: str, source_name: str = "Uploaded Text") -> dict:
-    chunks = chunk_text(text)
-    print(f"  {len(chunks)} chunk(s) to process", flush=True)
-
-    # ── 1. Extract locations via Qwen ────────────────────────────────────────
+def extraction_fingerprint() -> str:
+    """Everything besides the chunk text that determines the LLM's answer."""
+    parts = [get_llm().model_id, _EXTRACT_SYS, _EXTRACT_TPL, MAX_LLM_TOKENS, LLM_SAMPLING]
+    return json.dumps(parts + [EXTRACT_SCHEMA] if LLM_JSON_SCHEMA else parts)
+
+
+def process(text: str | Path, source_name: str = "Uploaded Text", **options) -> dict:
+    """Run the full pipeline and return the FeatureCollection (see iter_features)."""
+    return {"type": "FeatureCollection",
+            "features": list(iter_features(text, source_name, **options))}
+
+
+def iter_features(text: str | Path, source_name: str = "Uploaded Text",
+                  scores_path: str | Path | None = None,
+                  journal_path: str | Path | None = None, resume: bool = False,
+                  use_prefilter: bool = False):
+    """
+    Run the full pipeline, yielding each GeoJSON feature as soon as it is
+    classified (in batches of CLASSIFY_BATCH), so callers can stream output.
+
+    text         : the book as a string, or a Path streamed through a memory
+                   map — chunks are cut lazily and fed straight to the LLM, so
+                   only the chunks in flight are held in memory
+    scores_path  : write raw similarity scores here (see rethreshold.py)
+    journal_path : append each chunk's extraction result here as it finishes
+    resume       : reuse results already in the journal instead of re-inferring
+    use_prefilter: skip the LLM for chunks without place candidates (prefilter.py)
+    """
+    # ── 1. Extract locations via the LLM (streamed, concurrent, journaled) ───
+    journal = (ExtractionJournal(journal_path, extraction_fingerprint(), resume)
+               if journal_path else None)
+    counts = new_counts()
     raw_locations: list[dict] = []
-    for i, chunk in enumerate(chunks, 1):
-        print(f"  [LLM] Chunk {i}/{len(chunks)} — extracting locations…", flush=True)
-        found = extract_from_chunk(chunk)
-        raw_locations.extend(found)
-        print(f"         → {len(found)} found", flush=True)
-
-    # ── 2. Deduplicate by (name_lower, first-80-chars-of-context) ────────────
+    prev: list[dict] = []
+    t0 = time.perf_counter()
+    try:
+        for n, ((chunk, _, meta), (found, fresh)) in enumerate(
+                imap_ordered(extract_task, chunk_tasks(text, journal, use_prefilter, counts),
+                             get_llm().max_in_flight), 1):
+            if found is None:
+                counts["failed"] += 1
+                print(f"  ⚠  Chunk {n}: LLM request failed ({fresh}) — left for --resume",
+                      flush=True)
+                continue
+            if fresh:
+                counts["new"] += 1
+                if journal is not None:
+                    journal.record(chunk, found)
+                print(f"  [LLM] Chunk {n} ({counts['new']} new) → {len(found)} found",
+                      flush=True)
+            if CHUNK_OVERLAP and CHUNK_TOKENS > 0:
+                found, prev = drop_repeats(prev, found), found
+            raw_locations.extend({**loc, **meta} for loc in found)
+    finally:
+        if journal is not None:
+            journal.close()
+        metrics.observe("stage_seconds", time.perf_counter() - t0, stage="extract")
+    report_extraction(counts, journal, use_prefilter)
+
+    yield from locate_and_classify(raw_locations, source_name, scores_path)
+    print_cache_stats()
+
+
+def new_counts() -> dict:
+    return {"chunks": 0, "skipped": 0, "new": 0, "failed": 0}
+
+
+def chunk_tasks(source: str | Path, journal: ExtractionJournal | None,
+                use_prefilter: bool, counts: dict):
+    """
+    ``(chunk, found, meta)`` for each chunk of ``source``; ``found`` is already
+    set for journal hits and place-free chunks, None when the LLM must run.
+    Pulled lazily by ``imap_ordered`` in the caller's thread.
+    """
+    gazetteer = None
+    if use_prefilter and GEOCODER == "gazetteer":
+        geocoder  = get_geocoder()
+        gazetteer = geocoder.index if geocoder else None
+    for chunk, meta in iter_source_chunks(source):
+        counts["chunks"] += 1
+        found = journal.get(chunk) if journal is not None else None
+        if found is None and use_prefilter and not has_place_candidate(chunk, gazetteer):
+            counts["skipped"] += 1
+            found = []
+        yield chunk, found, meta
+
+
+def extract_task(task: tuple) -> tuple[list[dict] | None, bool | str]:
+    """
+    (locations, fresh) for a ``chunk_tasks`` item; fresh means the LLM ran.
+    A chunk whose request fails comes back as ``(None, reason)`` so the caller
+    can log it and leave it out of the journal — ``--resume`` retries it.
+    """
+    chunk, found = task[:2]
+    if found is not None:
+        return found, False
+    try:
+        return extract_from_chunk(chunk), True
+    except Exception as e:
+        metrics.inc("llm_errors_total")
+        return None, f"{type(e).__name__}: {e}"
+
+
+def report_extraction(counts: dict, journal: ExtractionJournal | None,
+                      use_prefilter: bool) -> None:
+    metrics.inc("chunks_total", counts["chunks"])
+    metrics.inc("chunks_skipped_total", counts["skipped"])
+    metrics.inc("chunks_resumed_total", journal.reused if journal is not None else 0)
+    print(f"  {counts['chunks']} chunk(s) processed, {counts['new']} sent to the LLM",
+          flush=True)
+    if counts["failed"]:
+        print(f"  ⚠  {counts['failed']} chunk(s) failed — rerun with --resume to retry them",
+              flush=True)
+    if use_prefilter:
+        print(f"  Pre-filter: {counts['skipped']}/{counts['chunks']} chunk(s) have no place "
+              f"candidates → {counts['skipped']} LLM call(s) saved", flush=True)
+    if journal is not None and journal.reused:
+        print(f"  Resumed {journal.reused}/{counts['chunks']} chunk(s) from {journal.path}",
+              flush=True)
+
+
+def _chapter_props(loc: dict) -> dict:
+    if "chapter" not in loc:
+        return {}
+    return {"Chapter": loc["chapter"], "ChapterIndex": loc["chapter_index"],
+            "Offset": loc["offset"]}
+
+
+def dedupe(raw_locations: list[dict]) -> list[dict]:
+    """First mention per (name_lower, first-80-chars-of-context), in order."""
     seen, unique = set(), []
     for loc in raw_locations:
         key = (loc["name"].lower(), loc["context"][:80])
         if key not in seen:
             seen.add(key)
             unique.append(loc)
-    print(f"\n  {len(unique)} unique location entries after dedup", flush=True)
+    return unique
 
-    # ── 3. Classify + geocode ────────────────────────────────────────────────
-    features: list[dict] = []
-    for i, loc in enumerate(unique, 1):
-        name = loc["name"]
-        print(f"  [{i}/{len(unique)}] {name}", end="  ", flush=True)
 
-        coords = geocode(name)
+def locate_and_classify(raw_locations: list[dict], source_name: str,
+                        scores_path: str | Path | None = None):
+    """Steps 2–4: dedup, geocode and classify extracted mentions into features."""
+    # ── 2. Deduplicate by (name_lower, first-80-chars-of-context) ────────────
+    unique = dedupe(raw_locations)
+    metrics.inc("mentions_raw_total", len(raw_locations))
+    metrics.inc("mentions_unique_total", len(unique))
+    print(f"\n  {len(unique)} unique location entries after dedup", flush=True)
 
+    # ── 3. Geocode each canonical place once (concurrent, cached) ───────────
+    queries = canonicalize([loc["name"] for loc in unique])
+    places  = len(set(queries))
+    print(f"  Geocoding {len(unique)} entries as {places} canonical place(s)…", flush=True)
+    with metrics.timer("stage_seconds", stage="geocode"):
+        all_coords = geocode_all(queries)
+    metrics.inc("geocode_lookups_total", len(unique))
+    metrics.inc("geocode_places_total", places)
+    metrics.inc("geocode_not_found_total", sum(1 for c in all_coords if not c))
+
+    # Offline point-in-polygon check, whatever the geocoder or cache returned.
+    inside = [True] * len(unique)
+    regions = region_filter()
+    if regions:
+        index, names = regions
+        inside = index.contains(all_coords, names)
+        metrics.inc("geocode_outside_region_total",
+                    sum(1 for c, ok in zip(all_coords, inside) if c and not ok))
+
+    located: list[tuple[dict, tuple[float, float]]] = []
+    for i, (loc, coords) in enumerate(zip(unique, all_coords), 1):
+        print(f"  [{i}/{len(unique)}] {loc['name']}", end="  ", flush=True)
         if not coords:
             print("✗ not geocoded — skipped")
             continue
+        if not inside[i - 1]:
+            print(f"✗ outside {', '.join(regions[1])} — skipped")
+            continue
+        located.append((loc, coords))
+        print(f"✓  {coords[1]:.4f}, {coords[0]:.4f}")
 
-        topics, themes = classify(loc["context"])
-
-        features.append({
-            "type": "Feature",
-            "geometry": {
-                "type": "Point",
-                "coordinates": list(coords)   # [lon, lat]
-            },
-            "properties": {
-                "LocationName": name,
-                "context":      loc["context"],
-                "Sentiment":    loc["sentiment"],
-                "Confidence":   "",
-                "Literature":   source_name,
-                "topics":       topics,
-                "themes":       themes,
+    # ── 4. Classify in large batches and emit features as they are done ─────
+    print(f"\n  Classifying {len(located)} context(s)…", flush=True)
+    topic_parts: list[np.ndarray] = []
+    theme_parts: list[np.ndarray] = []
+    for start in range(0, len(located), CLASSIFY_BATCH):
+        batch = located[start:start + CLASSIFY_BATCH]
+        with metrics.timer("stage_seconds", stage="classify"):
+            topic_scores, theme_scores = score_batch([loc["context"] for loc, _ in batch])
+        metrics.inc("features_total", len(batch))
+        topic_parts.append(topic_scores)
+        theme_parts.append(theme_scores)
+        topic_tab = topic_scores >= TOPIC_THRESHOLD
+        theme_tab = theme_scores >= THEME_THRESHOLD
+        for (loc, coords), topic_row, theme_row in zip(batch, topic_tab, theme_tab):
+            yield {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": list(coords)   # [lon, lat]
+                },
+                "properties": {
+                    "LocationName": loc["name"],
+                    "context":      loc["context"],
+                    "Sentiment":    loc["sentiment"],
+                    "Confidence":   "",
+                    "Literature":   source_name,
+                    "topics":       _labels(_topic_keys, topic_row),
+                    "themes":       _labels(_theme_keys, theme_row),
+                    **_chapter_props(loc),
+                }
             }
-        })
-        print(f"✓  {coords[1]:.4f}, {coords[0]:.4f}")
 
-    return {"type": "FeatureCollection", "features": features}
+    if scores_path:
+        empty = lambda keys: [np.zeros((0, len(keys)), dtype=np.float32)]
+        save_scores(scores_path,
+                    np.concatenate(topic_parts or empty(_topic_keys)),
+                    np.concatenate(theme_parts or empty(_theme_keys)),
+                    _topic_keys, _theme_keys, TOPIC_THRESHOLD, THEME_THRESHOLD)
+        print(f"  Similarity scores → {scores_path}", flush=True)
+
+
+def print_cache_stats() -> None:
+    if LLM_CACHE:
+        lstats = llm_cache().stats
+        print(f"  LLM cache: {lstats['hits']} hit(s), {lstats['misses']} miss(es) "
+              f"(hit rate {lstats['hit_rate']:.0%}), {lstats['entries']} entries", flush=True)
+    if _embed_store is not None:
+        estats = _embed_store.stats
+        print(f"  Embedding store: {estats['hits']} reused, {estats['misses']} encoded, "
+              f"{estats['entries']} stored", flush=True)
+    if GEOCODER == "mapbox":
+        gstats = geocode_cache().stats
+        print(f"\n  Geocode cache: {gstats['hits']} hit(s), {gstats['misses']} miss(es) "
+              f"({gstats['negative_hits']} negative), {gstats['entries']} entries", flush=True)
+
+# =============================================================================
+# RUN REPORT  (see metrics.py)
+# =============================================================================
+
+def _rate(num: float, seconds: float) -> float | None:
+    return round(num / seconds, 3) if seconds else None
+
+
+def run_report(**info) -> dict:
+    """Headline per-stage figures derived from ``metrics``, plus the raw snapshot."""
+    m       = metrics
+    extract = m.summary("stage_seconds", stage="extract")["sum"]
+    embed_s = m.summary("embed_seconds")["sum"]
+    raw     = m.counter("mentions_raw_total")
+    lookups = m.counter("geocode_lookups_total")
+    summary = {
+        "chunks":              m.counter("chunks_total"),
+        "chunks_skipped":      m.counter("chunks_skipped_total"),
+        "chunks_resumed":      m.counter("chunks_resumed_total"),
+        "llm_requests":        m.counter("llm_requests_total"),
+        "llm_errors":          m.counter("llm_errors_total"),
+        "llm_cache_hits":      m.counter("llm_cache_hits_total"),
+        "llm_prompt_tokens":   m.counter("llm_prompt_tokens_total"),
+        "llm_completion_tokens": m.counter("llm_completion_tokens_total"),
+        "llm_tokens_per_sec":  _rate(m.counter("llm_completion_tokens_total"), extract),
+        "llm_latency_seconds": m.summary("llm_latency_seconds"),
+        "dedup_ratio":         round(m.counter("mentions_unique_total") / raw, 4) if raw else None,
+        "geocode_lookups":     lookups,
+        "geocode_places":      m.counter("geocode_places_total"),
+        "geocode_not_found":   m.counter("geocode_not_found_total"),
+        "geocode_outside_region": m.counter("geocode_outside_region_total"),
+        "geocode_errors":      m.counter("geocode_errors_total", provider="mapbox"),
+        "geocode_request_seconds": m.summary("geocode_request_seconds", provider="mapbox"),
+        "embed_texts_per_sec": _rate(m.counter("embed_texts_total"), embed_s),
+        "features":            m.counter("features_total"),
+        "stage_seconds":       {stage: round(m.summary("stage_seconds", stage=stage)["sum"], 3)
+                                for stage in ("extract", "geocode", "classify")},
+        "peak_rss_mb":         round((peak_rss_bytes() or 0) / 2**20, 1),
+    }
+    return {**info, "summary": summary, "metrics": m.snapshot()}
+
+
+def print_run_summary(report: dict) -> None:
+    s   = report["summary"]
+    lat = s["llm_latency_seconds"]
+    stages = "  ".join(f"{k} {v:.1f}s" for k, v in s["stage_seconds"].items())
+    print(f"\n  Stages : {stages}", flush=True)
+    if lat["count"]:
+        print(f"  LLM    : {int(s['llm_requests'])} call(s), {s['llm_tokens_per_sec'] or 0:.1f} tok/s, "
+              f"latency p50 {lat['p50']:.2f}s  p90 {lat['p90']:.2f}s  p99 {lat['p99']:.2f}s", flush=True)
+    print(f"  Peak RSS {s['peak_rss_mb']:.0f} MB", flush=True)
+
+# =============================================================================
+# WARM WORKER  (models stay resident between invocations)
+# =============================================================================
+
+# Jobs are pickled over the connection, so only holders of the auth key may
+# connect: $PIPELINE_WORKER_KEY, else a random key kept in a 0600 file.
+WORKER_ADDRESS  = os.getenv("PIPELINE_WORKER", str(CACHE_DIR / "worker.sock")
+                            if hasattr(socket, "AF_UNIX") else "127.0.0.1:7071")
+WORKER_KEY_FILE = CACHE_DIR / "worker.key"
+OUTPUT_SUFFIXES = {".geojson", ".json", ".ndjson"}
+
+
+def _parse_address(address: str):
+    """"host:port" → (host, port); anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port)) if sep and port.isdigit() else address
+
+
+def worker_authkey(create: bool = False) -> bytes:
+    """The worker auth key; ``create`` writes a random one if none exists yet."""
+    if os.getenv("PIPELINE_WORKER_KEY"):
+        return os.environ["PIPELINE_WORKER_KEY"].encode()
+    path = WORKER_KEY_FILE
+    if create and not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "w") as fh:
+                fh.write(secrets.token_hex(32))
+        except FileExistsError:
+            pass
+    if not path.exists():
+        raise RuntimeError(f"No worker key: set PIPELINE_WORKER_KEY or start a worker "
+                           f"(`pipeline.py --serve`) to create {path}")
+    if os.name == "posix" and path.stat().st_mode & 0o077:
+        raise RuntimeError(f"{path} is readable by other users — chmod 600 it")
+    return path.read_text().strip().encode()
+
+
+def _check_job(job: dict) -> None:
+    """Refuse jobs that would read or write anything but books and pipeline outputs."""
+    input_path = Path(job["input"])
+    if not input_path.is_absolute() or input_path.suffix.lower() not in {".txt"} | MARKUP_SUFFIXES:
+        raise ValueError(f"Refusing input {input_path}: not an absolute .txt/.epub/.html path")
+    out = Path(job["out"])
+    if not out.is_absolute() or out.suffix.lower() not in OUTPUT_SUFFIXES:
+        raise ValueError(f"Refusing output {out}: not an absolute .geojson/.ndjson path")
+    prom = job.get("prometheus")
+    if prom and (not Path(prom).is_absolute() or Path(prom).suffix.lower() != ".prom"):
+        raise ValueError(f"Refusing Prometheus path {prom}: not an absolute .prom path")
+    if job.get("geocoder", GEOCODER) not in ("mapbox", "gazetteer"):
+        raise ValueError(f"Unknown geocoder {job['geocoder']!r}")
+
+
+def configure_geocoder(kind: str, gazetteer_dir: str | Path) -> None:
+    """Switch the geocoder backend, dropping the current one if it changed."""
+    global GEOCODER, GAZETTEER_DIR, _geocoder
+    if (kind, str(gazetteer_dir)) != (GEOCODER, str(GAZETTEER_DIR)):
+        if _geocoder is not None:
+            _geocoder.close()
+        _geocoder = None
+    GEOCODER, GAZETTEER_DIR = kind, str(gazetteer_dir)
+
+
+def run_job(input_path: Path, output_path: Path, source_name: str,
+            resume: bool = False, use_prefilter: bool = PREFILTER,
+            fmt: str | None = None, prometheus_path: Path | None = None) -> int:
+    """
+    Process one book end to end; return the number of features written.
+    The run report goes to ``<out>.metrics.json`` (and Prometheus text to
+    ``prometheus_path`` when given).
+    """
+    metrics.reset()
+    get_geocoder()   # fail now (e.g. no gazetteer index), not after extraction
+    region_filter()  # … or an unknown REGION_FILTER name
+    print(f"\n{'='*50}")
+    print(f"  Literary Geography Pipeline")
+    print(f"{'='*50}")
+    print(f"  Input  : {input_path}")
+    print(f"  Output : {output_path}")
+    print(f"  Source : {source_name}")
+    print(f"{'='*50}\n")
+
+    print(f"  Text: {input_path.stat().st_size:,} bytes (streamed)\n")
+
+    features = iter_features(input_path, source_name, scores_path_for(output_path),
+                             journal_path_for(output_path), resume, use_prefilter)
+    with FeatureWriter(output_path, fmt) as writer:
+        n = writer.write_all(features)
+
+    report = run_report(source=source_name, input=str(input_path), out=str(output_path))
+    write_report(metrics_path_for(output_path), report)
+    print_run_summary(report)
+    print(f"  Run report → {metrics_path_for(output_path)}", flush=True)
+    if prometheus_path:
+        metrics.write_prometheus(prometheus_path)
+        print(f"  Prometheus metrics → {prometheus_path}", flush=True)
+    return n
+
+
+def serve(address: str = WORKER_ADDRESS) -> None:
+    """Load every model once, then run jobs sent by `pipeline.py --worker`."""
+    from multiprocessing import AuthenticationError
+    from multiprocessing.connection import Listener
+
+    authkey = worker_authkey(create=True)
+    target  = _parse_address(address)
+    if isinstance(target, tuple):
+        host = target[0]
+        try:
+            public = not ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+        except (OSError, ValueError):
+            public = True
+        if public:
+            print(f"    ⚠  Worker reachable beyond this machine on {address}; "
+                  f"anyone with the auth key can run jobs", flush=True)
+    else:
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        _remove_stale_socket(target)
+
+    get_llm()   # registers the in-process model, if the backend has one
+    registry.preload()
+    seed_vectors()
+    umask = os.umask(0o077)   # no window in which the Unix socket is group/world accessible
+    try:
+        listener = Listener(target, authkey=authkey)
+    finally:
+        os.umask(umask)
+    if isinstance(target, str):
+        os.chmod(target, 0o600)
+    with listener:
+        print(f"✓   Worker listening on {address}\n", flush=True)
+        while True:
+            try:
+                conn = listener.accept()   # authenticates before anything is unpickled
+            except (AuthenticationError, EOFError, OSError) as e:
+                print(f"    ⚠  Rejected connection: {e}", flush=True)
+                continue
+            with conn:
+                try:
+                    job = conn.recv()
+                    shutdown = job.get("cmd") == "shutdown"
+                except (EOFError, OSError, AttributeError) as e:
+                    # Client went away before sending (e.g. Ctrl-C) or sent a non-dict.
+                    print(f"    ⚠  Dropped job: {type(e).__name__}: {e}", flush=True)
+                    continue
+                t0 = time.perf_counter()
+                if shutdown:
+                    reply = {"ok": True}
+                else:
+                    try:
+                        _check_job(job)
+                        configure_geocoder(job.get("geocoder", GEOCODER),
+                                           job.get("gazetteer", GAZETTEER_DIR))
+                        n = run_job(Path(job["input"]), Path(job["out"]), job["source"],
+                                    job.get("resume", False), job.get("prefilter", PREFILTER),
+                                    job.get("format"),
+                                    Path(job["prometheus"]) if job.get("prometheus") else None)
+                        reply = {"ok": True, "features": n,
+                                 "seconds": round(time.perf_counter() - t0, 2)}
+                    except Exception as e:
+                        reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                try:
+                    conn.send(reply)
+                except OSError as e:   # client gone; the job's output is on disk regardless
+                    print(f"    ⚠  Could not send the result: {e}", flush=True)
+                if shutdown:
+                    return
+
+
+def _remove_stale_socket(path: str) -> None:
+    """Delete a socket file left by a worker that died without cleaning up."""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+    else:
+        raise RuntimeError(f"A worker is already listening on {path}")
+    finally:
+        probe.close()
+
+
+def submit(job: dict, address: str = WORKER_ADDRESS) -> dict:
+    from multiprocessing.connection import Client
+
+    with Client(_parse_address(address), authkey=worker_authkey()) as conn:
+        conn.send(job)
+        return conn.recv()
 
 # =============================================================================
 # CLI
@@ -292,12 +878,41 @@ def process(text: str, source_name: str = "Uploaded Text") -> dict:
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
-        description="Literary geography pipeline — .txt → GeoJSON"
+        description="Literary geography pipeline — .txt / .epub → GeoJSON"
     )
-    parser.add_argument("input",           help="Input .txt file")
-    parser.add_argument("--out",  "-o",    help="Output .geojson (default: same stem)")
+    parser.add_argument("input", nargs="?", help="Input .txt, .epub or .html file")
+    parser.add_argument("--out",  "-o",    help="Output .geojson or .ndjson (default: same stem)")
+    parser.add_argument("--format",        choices=("collection", "ndjson"),
+                        help="Output format (default: from the --out suffix)")
     parser.add_argument("--source", "-s",  help="Source / book name tag", default="")
+    parser.add_argument("--geocoder",      choices=("mapbox", "gazetteer"), default=GEOCODER,
+                        help="Geocoding backend (default: $GEOCODER or mapbox)")
+    parser.add_argument("--gazetteer",     help="Compiled gazetteer index directory",
+                        default=GAZETTEER_DIR)
+    parser.add_argument("--resume",        action="store_true",
+                        help="Skip chunks already in <out>.journal.jsonl")
+    parser.add_argument("--prefilter",     action=argparse.BooleanOptionalAction,
+                        default=PREFILTER,
+                        help="Skip LLM calls for chunks with no place candidates")
+    parser.add_argument("--prometheus",    metavar="PATH",
+                        help="Also write run metrics in Prometheus text format (.prom)")
+    parser.add_argument("--serve",         nargs="?", const=WORKER_ADDRESS, metavar="ADDR",
+                        help="Run as a warm worker that keeps models loaded")
+    parser.add_argument("--worker",        nargs="?", const=WORKER_ADDRESS, metavar="ADDR",
+                        help="Send the job to a running --serve worker")
+    parser.add_argument("--stop-worker",   nargs="?", const=WORKER_ADDRESS, metavar="ADDR",
+                        help="Shut down a running worker")
     args = parser.parse_args()
+    GEOCODER, GAZETTEER_DIR = args.geocoder, args.gazetteer
+
+    if args.serve:
+        serve(args.serve)
+        sys.exit(0)
+    if args.stop_worker:
+        submit({"cmd": "shutdown"}, args.stop_worker)
+        sys.exit(0)
+    if not args.input:
+        parser.error("the following arguments are required: input")
 
     input_path  = Path(args.input)
     output_path = Path(args.out) if args.out else input_path.with_suffix(".geojson")
@@ -307,24 +922,28 @@ if __name__ == "__main__":
         print(f"Error: {input_path} not found")
         sys.exit(1)
 
-    print(f"\n{'='*50}")
-    print(f"  Literary Geography Pipeline")
-    print(f"{'='*50}")
-    print(f"  Input  : {input_path}")
-    print(f"  Output : {output_path}")
-    print(f"  Source : {source_name}")
-    print(f"{'='*50}\n")
-
-    text = input_path.read_text(encoding="utf-8")
-    print(f"  Text: {len(text):,} characters\n")
-
-    geojson = process(text, source_name)
-
-    output_path.write_text(
-        json.dumps(geojson, ensure_ascii=False, indent=2),
-        encoding="utf-8"
-    )
+    if args.worker:
+        reply = submit({"cmd": "run", "input": str(input_path.resolve()),
+                        "out": str(output_path.resolve()), "source": source_name,
+                        "resume": args.resume, "prefilter": args.prefilter,
+                        "format": args.format, "geocoder": args.geocoder,
+                        "gazetteer": str(Path(args.gazetteer).resolve()),
+                        "prometheus": str(Path(args.prometheus).resolve())
+                                      if args.prometheus else None},
+                       args.worker)
+        if not reply["ok"]:
+            print(f"Error (worker): {reply['error']}")
+            sys.exit(1)
+        n_features = reply["features"]
+    else:
+        try:
+            n_features = run_job(input_path, output_path, source_name, args.resume,
+                                 args.prefilter, args.format,
+                                 Path(args.prometheus) if args.prometheus else None)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
 
     print(f"\n{'='*50}")
-    print(f"  Done. {len(geojson['features'])} features → {output_path}")
+    print(f"  Done. {n_features} features → {output_path}")
     print(f"{'='*50}\n")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Place-candidate pre-filter
+==========================
+Cheap CPU check that decides whether a chunk could possibly contain a real
+place name before it is sent to the LLM.  Long stretches of dialogue and
+reflection (Walden has many) are skipped outright.
+
+A chunk is kept if any capitalized span in it
+  * carries a geographic head word        ("Walden Pond", "Mississippi River")
+  * follows a locative preposition        ("drove to Denver", "born in Ohio")
+  * is a known place abbreviation         ("NYC", "L.A.")
+  * is a common bare place name           ("Alaska", "America", "Boston")
+  * is a name in the offline gazetteer    (when an index is available)
+
+Recall against an existing output can be measured with
+
+  python prefilter.py walden.txt --truth ../output_final.geojson --literature Walden
+"""
+
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+
+GEO_HEADS = {
+    "river", "lake", "pond", "mount", "mt", "mountain", "mountains", "hill",
+    "hills", "street", "st", "avenue", "ave", "road", "highway", "route",
+    "boulevard", "city", "county", "state", "states", "island", "islands",
+    "bay", "valley", "canyon", "park", "creek", "desert", "forest", "ocean",
+    "sea", "falls", "gulf", "coast", "peninsula", "harbor", "harbour",
+    "beach", "trail", "pass", "range", "plains", "prairie", "glacier",
+    "village", "town", "square", "bridge", "station", "national", "north",
+    "south", "east", "west", "new", "san", "santa", "los", "las", "fort",
+    "port", "cape", "point", "springs", "heights",
+}
+
+LOCATIVES = {
+    "in", "at", "to", "from", "into", "near", "toward", "towards", "across",
+    "through", "via", "outside", "around", "past", "beyond", "reach",
+    "reached", "visit", "visited", "leave", "left", "entered", "crossed",
+    "north", "south", "east", "west", "of",
+}
+
+# Capitalized words that are never places on their own.
+NON_PLACES = {
+    "i", "i'm", "i'd", "i'll", "i've", "the", "a", "an", "he", "she", "it", "we",
+    "they", "you", "my", "his", "her", "our", "their", "mr", "mrs", "ms", "dr",
+    "god", "lord", "oh", "yes", "no", "well", "but", "and", "then", "so", "now",
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+    "january", "february", "march", "april", "may", "june", "july", "august",
+    "september", "october", "november", "december", "chapter", "christmas",
+}
+
+PLACE_ABBREVIATIONS = {"nyc", "la", "l.a.", "sf", "dc", "d.c.", "usa", "u.s.",
+                       "u.s.a.", "uk", "nola", "frisco", "philly"}
+
+# Tiny built-in gazetteer: names common enough to appear bare in any book.
+COMMON_PLACES = {
+    "alabama", "alaska", "arizona", "arkansas", "california", "colorado",
+    "connecticut", "delaware", "florida", "georgia", "hawaii", "idaho",
+    "illinois", "indiana", "iowa", "kansas", "kentucky", "louisiana", "maine",
+    "maryland", "massachusetts", "michigan", "minnesota", "mississippi",
+    "missouri", "montana", "nebraska", "nevada", "new hampshire", "new jersey",
+    "new mexico", "new york", "north carolina", "north dakota", "ohio",
+    "oklahoma", "oregon", "pennsylvania", "rhode island", "south carolina",
+    "south dakota", "tennessee", "texas", "utah", "vermont", "virginia",
+    "washington", "west virginia", "wisconsin", "wyoming",
+    "america", "canada", "mexico", "europe", "asia", "africa", "england",
+    "france", "germany", "italy", "spain", "china", "india", "japan", "russia",
+    "ireland", "scotland", "greece", "egypt", "persia", "arabia",
+    "boston", "chicago", "denver", "seattle", "frisco", "hollywood",
+    "concord", "cambridge", "brooklyn", "manhattan", "harlem", "detroit",
+    "pittsburgh", "baltimore", "fairbanks", "anchorage", "atlanta", "dallas",
+    "houston", "phoenix", "portland", "sacramento", "reno", "tucson",
+}
+
+_SPAN = re.compile(
+    r"(?:(?<=\s)|^|(?<=[\"'“‘(]))"
+    r"((?:[A-Z][\w’'.-]*)(?:[ \t]+(?:(?:of|the|de|del|la|du|on|upon)[ \t]+)?[A-Z][\w’'.-]*)*)"
+)
+_PREV_WORD = re.compile(r"([A-Za-z']+)\W*$")
+_LEADING   = NON_PLACES | LOCATIVES
+
+
+def candidate_spans(chunk: str) -> list[tuple[str, str]]:
+    """(span, preceding word) for every capitalized span in ``chunk``."""
+    out = []
+    for m in _SPAN.finditer(chunk):
+        words = m.group(1).split()
+        prev  = _PREV_WORD.search(chunk, max(0, m.start() - 40), m.start())
+        prev  = prev.group(1).lower() if prev else ""
+        # Sentence-initial function words ("In Seattle", "The Yukon") are context.
+        while words and words[0].lower() in _LEADING:
+            prev = words.pop(0).lower()
+        span = " ".join(words).strip(" .,;:'’-")
+        if span:
+            out.append((span, prev))
+    return out
+
+
+def has_place_candidate(chunk: str, gazetteer=None) -> bool:
+    for span, prev in candidate_spans(chunk):
+        words = [w.strip(".,;:'’").lower() for w in span.split()]
+        if span.lower() in PLACE_ABBREVIATIONS or words[0] in PLACE_ABBREVIATIONS:
+            return True
+        if " ".join(words) in COMMON_PLACES or words[-1] in COMMON_PLACES:
+            return True
+        if len(words) > 1 and (words[-1] in GEO_HEADS or words[0] in GEO_HEADS):
+            return True
+        if prev in LOCATIVES and words[0] not in NON_PLACES:
+            return True
+        if gazetteer is not None and gazetteer.normalized(span, limit=1):
+            return True
+    return False
+
+
+def prefilter(chunks: list[str], gazetteer=None) -> list[bool]:
+    """Keep-mask for ``chunks``: False means the LLM call can be skipped."""
+    return [has_place_candidate(c, gazetteer) for c in chunks]
+
+# =============================================================================
+# RECALL CHECK
+# =============================================================================
+
+def _squash(s: str) -> str:
+    return re.sub(r"\s+", " ", s).strip()
+
+
+def measure_recall(chunks: list[str], keep: list[bool], features: list[dict]) -> dict:
+    """
+    For every reference feature whose context can be located in a chunk, check
+    whether that chunk survives the filter.
+    """
+    squashed = [_squash(c) for c in chunks]
+    located = kept = 0
+    missed: list[str] = []
+    for feat in features:
+        props   = feat.get("properties", {})
+        snippet = _squash(props.get("context", ""))[:60]
+        if not snippet:
+            continue
+        hits = [i for i, c in enumerate(squashed) if snippet in c]
+        if not hits:
+            continue
+        located += 1
+        if any(keep[i] for i in hits):
+            kept += 1
+        else:
+            missed.append(props.get("LocationName", ""))
+    return {
+        "features_located": located,
+        "features_kept":    kept,
+        "recall":           round(kept / located, 4) if located else None,
+        "missed":           missed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM pre-filter report / recall check")
+    parser.add_argument("input",             help="Input book (.txt, .epub or .html)")
+    parser.add_argument("--truth",           help="Reference GeoJSON (e.g. output_final.geojson)")
+    parser.add_argument("--literature",      help="Only use truth features with this Literature tag")
+    parser.add_argument("--gazetteer",       help="Compiled gazetteer index directory")
+    args = parser.parse_args()
+
+    from pipeline import iter_source_chunks
+
+    chunks = [chunk for chunk, _ in iter_source_chunks(Path(args.input))]
+    gaz    = None
+    if args.gazetteer:
+        from gazetteer import Gazetteer
+        gaz = Gazetteer(args.gazetteer)
+    keep = prefilter(chunks, gaz)
+    skipped = keep.count(False)
+    print(f"  {len(chunks)} chunk(s), {skipped} skipped "
+          f"→ {skipped} LLM call(s) saved ({skipped / max(len(chunks), 1):.0%})")
+
+    if args.truth:
+        features = json.loads(Path(args.truth).read_text(encoding="utf-8"))["features"]
+        if args.literature:
+            features = [f for f in features
+                        if f.get("properties", {}).get("Literature") == args.literature]
+        report = measure_recall(chunks, keep, features)
+        if report["recall"] is None:
+            print("  No reference contexts found in this text")
+            sys.exit(1)
+        print(f"  Recall: {report['features_kept']}/{report['features_located']} "
+              f"reference features kept ({report['recall']:.1%})")
+        for name in report["missed"][:20]:
+            print(f"    ✗ {name}")
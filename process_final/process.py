@@ -9,24 +9,30 @@ import csv
 import time
 import os
 import sys
-import openai
 import re  # Import the regular expression module
+import threading
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import googlemaps
 from nltk.sentiment import SentimentIntensityAnalyzer
 
+from cache import cached_geocode, geocode_cache
+from canonical import canonical_key, canonicalize
+from disambiguate import GPT_BATCH_SIZE, GPT_INFLIGHT, analyze_locations_with_gpt
+from regions import REGIONS_FILE, load_regions
+
 # ---------------------------
 # 1. API Key Setup
 # ---------------------------
-openai.api_key = os.getenv("OPENAI_API_KEY") 
-
-google_maps_api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+# GPT disambiguation (OPENAI_BASE_URL, GPT_MODEL, GPT_BATCH_SIZE, GPT_INFLIGHT)
+# is configured in disambiguate.py.
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "2"))          # sentiment scoring threads
+GEOCODE_WORKERS = int(os.getenv("GEOCODE_WORKERS", "8"))  # concurrent geocoding requests
+PIPELINE_WINDOW = int(os.getenv("PIPELINE_WINDOW", str(2 * GPT_BATCH_SIZE * GPT_INFLIGHT)))  # mentions in flight
+GEOCODE_REGION = os.getenv("GEOCODE_REGION", "US")           # keep places in this region (name / ISO code)
 
-if not google_maps_api_key:
-    print("Google Maps API key not found. Please set the 'GOOGLE_MAPS_API_KEY' environment variable.")
-    exit(1)
-
-# Initialize Google Maps client
-gmaps = googlemaps.Client(google_maps_api_key)
+gmaps = None  # Google Maps client, created by setup()
 
 # ---------------------------
 # 2. Text Extraction Functions
@@ -35,101 +41,173 @@ def extract_text(file_path):
     """
     Extracts text from an EPUB file.
     """
+    return '\n'.join(extract_chapters(file_path))
+
+def extract_chapters(file_path):
+    """
+    Extracts the text of each chapter (EPUB document) of a book, in order.
+    """
     if file_path.lower().endswith('.epub'):
-        return extract_text_from_epub(file_path)
+        return extract_chapters_from_epub(file_path)
     else:
         raise ValueError("Unsupported file format. Please provide an .epub file.")
 
-def extract_text_from_epub(file_path):
+def extract_chapters_from_epub(file_path):
     """
-    Reads an EPUB file and extracts its text content using BeautifulSoup.
+    Reads an EPUB file and extracts the text of each document using BeautifulSoup.
     """
     book = epub.read_epub(file_path)
-    text = []
+    chapters = []
     for item in book.get_items():
         if item.get_type() == ebooklib.ITEM_DOCUMENT:
             soup = BeautifulSoup(item.get_body_content(), 'html.parser')
-            text.append(soup.get_text())
-    return '\n'.join(text)
+            chapters.append(soup.get_text())
+    return chapters
+
+def iter_segments(chapters, max_chars):
+    """
+    Yields (segment, offset) pairs covering the chapters joined with newlines
+    (as extract_text does).  Chapters longer than max_chars are cut at the
+    last line break (else space) before the limit.
+    """
+    offset = 0
+    for chapter in chapters:
+        pos = 0
+        while len(chapter) - pos > max_chars:
+            cut = chapter.rfind('\n', pos + 1, pos + max_chars)
+            if cut == -1:
+                cut = chapter.rfind(' ', pos + 1, pos + max_chars)
+            if cut == -1:
+                cut = pos + max_chars
+            yield chapter[pos:cut], offset + pos
+            pos = cut
+        if pos < len(chapter):
+            yield chapter[pos:], offset + pos
+        offset += len(chapter) + 1
 
 # ---------------------------
 # 3. Setup NLP with spaCy
 # ---------------------------
-# Load the transformer-based spaCy model for English for improved NER.
-nlp = spacy.load("en_core_web_trf")
+# Load the transformer-based spaCy model for English for improved NER.  Only
+# the transformer, parser (sentence boundaries) and NER are needed.
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_trf")
+SPACY_PROCESSES = int(os.getenv("SPACY_PROCESSES", str(max(1, (os.cpu_count() or 1) // 2))))
+SPACY_BATCH_SIZE = int(os.getenv("SPACY_BATCH_SIZE", "4"))    # segments per batch
+SEGMENT_CHARS = int(os.getenv("SEGMENT_CHARS", "50000"))      # max characters per Doc
+nlp = None  # loaded by setup()
 
-def analyze_location_with_gpt(text, location_name):
+def run_ner(chapters):
     """
-    Uses GPT to analyze the text and determine the accurate location.
+    Runs NER over the book chapter by chapter (long chapters in segments)
+    with nlp.pipe, so no single huge Doc is built and segments are spread over
+    SPACY_PROCESSES worker processes.  Returns the book's SentenceIndex and its
+    GPE/LOC entities as (text, start_char, end_char), with offsets into the
+    text returned by extract_text.
     """
-    try:
-        response = openai.Completion.create(
-            engine="text-davinci-003",  # Or another suitable engine
-            prompt=f"Given the following text: '{text}', what is the most accurate and complete name of the location '{location_name}' being referred to? If the location is ambiguous, use context to resolve it. Respond only with the accurate location name.",
-            max_tokens=100,
-            n=1,
-            stop=None,
-            temperature=0.5,
-        )
-        accurate_location_name = response.choices[0].text.strip()
-        return accurate_location_name
+    text = '\n'.join(chapters)
+    sentence_spans = []
+    locations_info = []
+    segments = iter_segments(chapters, SEGMENT_CHARS)
+    for doc, offset in nlp.pipe(segments, as_tuples=True,
+                                n_process=SPACY_PROCESSES, batch_size=SPACY_BATCH_SIZE):
+        sentence_spans.extend((offset + sent.start_char, offset + sent.end_char) for sent in doc.sents)
+        for ent in doc.ents:
+            if ent.label_ in ["GPE", "LOC"]:
+                locations_info.append((ent.text, offset + ent.start_char, offset + ent.end_char))
+    return SentenceIndex(text, sentence_spans), locations_info
 
-    except Exception as e:
-        print(f"Error analyzing location with GPT: {e}")
-        return location_name  # Return original location if GPT fails
+def _google_lookup(location_name):
+    """
+    Raw Google Maps lookup: (lat, lng, country short name, country long name)
+    of the top result, None if the place is unknown; API errors propagate.
+    No region check here, so cached answers stay valid when GEOCODE_REGION or
+    REGIONS_FILE changes.
+    """
+    geocode_result = gmaps.geocode(location_name)
+    if not geocode_result:
+        print(f"Could not geocode {location_name} using Google Maps API.")
+        return None
+    location = geocode_result[0]['geometry']['location']
+    country = next((comp for comp in geocode_result[0]['address_components']
+                    if "country" in comp['types']), {})
+    return (location['lat'], location['lng'],
+            country.get('short_name', ""), country.get('long_name', ""))
+
+def in_region(latitude, longitude, country_short, country_long):
+    """
+    Whether a geocoded point lies in GEOCODE_REGION.  With REGIONS_FILE set this
+    is decided by the local boundary polygons (see regions.py), else by the
+    country Google reported (its ISO code or full name).
+    """
+    if REGIONS_FILE:
+        return bool(load_regions(REGIONS_FILE).contains([(longitude, latitude)], [GEOCODE_REGION])[0])
+    return GEOCODE_REGION.casefold() in (country_short.casefold(), country_long.casefold())
 
 def get_coordinates_from_google_maps(location_name):
     """
-    Uses Google Maps API to get coordinates for a location, but only if it's in the United States.
+    Uses Google Maps API to get coordinates for a location, but only if it's in
+    GEOCODE_REGION (the United States by default).  Raw results (including
+    misses) are kept in the persistent geocode cache; the region check runs on
+    every lookup, after the cache.
     """
     try:
-        geocode_result = gmaps.geocode(location_name)
-        if geocode_result:
-            # Check if the location's address components include United States.
-            country_ok = False
-            for comp in geocode_result[0]['address_components']:
-                if "country" in comp['types'] and (comp['long_name'] == "United States" or comp['short_name'] == "US"):
-                    country_ok = True
-                    break
-            if country_ok:
-                latitude = geocode_result[0]['geometry']['location']['lat']
-                longitude = geocode_result[0]['geometry']['location']['lng']
-                return latitude, longitude
-            else:
-                print(f"{location_name} is not located in the United States.")
-                return None, None
-        else:
-            print(f"Could not geocode {location_name} using Google Maps API.")
+        found = cached_geocode("google", location_name, _google_lookup)
+        if not found:
             return None, None
+        latitude, longitude = found[:2]
+        if in_region(*found):
+            return latitude, longitude
+        print(f"{location_name} is not located in {GEOCODE_REGION}.")
+        return None, None
 
     except Exception as e:
         print(f"Error getting coordinates from Google Maps API: {e}")
         return None, None
 
-def get_context(doc, start_char, end_char):
+class SentenceIndex:
+    """
+    Sentence boundaries of a document as sorted start/end offset arrays, built
+    once so each context lookup is a binary search instead of a scan over
+    every sentence.
+    """
+
+    def __init__(self, text, spans):
+        self.text = text
+        self.starts = [start for start, _ in spans]
+        self.ends = [end for _, end in spans]
+
+    def sentence(self, idx):
+        return self.text[self.starts[idx]:self.ends[idx]].strip()
+
+    def find(self, start_char, end_char):
+        """Index of the sentence containing [start_char, end_char), or None."""
+        idx = bisect_right(self.starts, start_char) - 1
+        if idx >= 0 and self.ends[idx] >= end_char:
+            return idx
+        return None
+
+def get_context(index, start_char, end_char):
     """
-    Retrieves the full sentence containing the target text from the spaCy document.
+    Retrieves the full sentence containing the target text from the sentence index.
     If the sentence has fewer than 15 words, appends the next sentence (if available).
     Returns the context as a string.
     """
-    sents = list(doc.sents)
-    for idx, sent in enumerate(sents):
-        if sent.start_char <= start_char and sent.end_char >= end_char:
-            sentence_text = sent.text.strip()
-            # Check if sentence is less than 15 words and if a next sentence exists.
-            if len(sentence_text.split()) < 15 and idx + 1 < len(sents):
-                sentence_text += " " + sents[idx + 1].text.strip()
-            return sentence_text
+    idx = index.find(start_char, end_char)
+    if idx is not None:
+        sentence_text = index.sentence(idx)
+        # Check if sentence is less than 15 words and if a next sentence exists.
+        if len(sentence_text.split()) < 15 and idx + 1 < len(index.starts):
+            sentence_text += " " + index.sentence(idx + 1)
+        return sentence_text
     # Fallback: Return a longer fixed window if no sentence boundary is found.
     context_start = max(0, start_char - 100)
-    context_end = min(len(doc.text), end_char + 100)
-    return doc.text[context_start:context_end].strip()
+    context_end = min(len(index.text), end_char + 100)
+    return index.text[context_start:context_end].strip()
 
 # ---------------------------
 # 4. Sentiment Analysis Setup
 # ---------------------------
-# Initialize sentiment analyzer
-sia = SentimentIntensityAnalyzer()
+sia = None  # VADER sentiment analyzer, created by setup()
 
 def analyze_emotion(text):
     """
@@ -152,17 +230,118 @@ def analyze_emotion(text):
     return label, confidence
 
 # ---------------------------
-# 5. Main Workflow
+# 5. Pipelined Enrichment
 # ---------------------------
+class EnrichmentPipeline:
+    """
+    Enriches place mentions in stages that overlap instead of running one after
+    another for each mention:
+
+      sentiment   VADER on a CPU pool (CPU_WORKERS threads)
+      GPT         mentions grouped GPT_BATCH_SIZE at a time, up to GPT_INFLIGHT
+                  batches in flight (analyze_locations_with_gpt)
+      geocoding   each batch's answers canonicalized, then each canonical place
+                  geocoded once on a network pool (GEOCODE_WORKERS threads)
+
+    put() queues a mention and returns the rows that are finished; rows always
+    come out in input order.  At most PIPELINE_WINDOW mentions are in flight:
+    put() blocks on the oldest one when the window is full (backpressure).
+    """
+
+    def __init__(self):
+        self.cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS)
+        self.gpt_pool = ThreadPoolExecutor(max_workers=GPT_INFLIGHT)
+        self.geo_pool = ThreadPoolExecutor(max_workers=GEOCODE_WORKERS)
+        self.window = deque()   # (loc_text, context, sentiment future, location future)
+        self.batch = []         # (mention, location future) not yet sent to GPT
+        self.places = {}        # canonical key -> geocoding future
+        self.lock = threading.Lock()
+        self.mentions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for pool in (self.cpu_pool, self.gpt_pool, self.geo_pool):
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def put(self, loc_text, context):
+        sentiment = self.cpu_pool.submit(analyze_emotion, context)
+        location = Future()
+        self.batch.append(((loc_text, context), location))
+        self.window.append((loc_text, context, sentiment, location))
+        self.mentions += 1
+        if len(self.batch) >= GPT_BATCH_SIZE:
+            self._flush()
+        rows = []
+        while len(self.window) >= PIPELINE_WINDOW:
+            rows.append(self._pop())
+        return rows
+
+    def drain(self):
+        self._flush()
+        while self.window:
+            yield self._pop()
+
+    def _flush(self):
+        if self.batch:
+            self.gpt_pool.submit(self._resolve, self.batch)
+            self.batch = []
+
+    def _resolve(self, batch):
+        """GPT stage: disambiguate a batch, then hand each place to the geocoder."""
+        try:
+            accurate = analyze_locations_with_gpt([mention for mention, _ in batch])
+            for (_, location), name, query in zip(batch, accurate, canonicalize(accurate)):
+                location.set_result((name, self._geocode(query)))
+        except Exception as e:
+            for _, location in batch:
+                if not location.done():
+                    location.set_exception(e)
+
+    def _geocode(self, query):
+        """Geocoding future for a place; one lookup per canonical place."""
+        key = canonical_key(query) or query
+        with self.lock:
+            if key not in self.places:
+                self.places[key] = self.geo_pool.submit(get_coordinates_from_google_maps, query)
+            return self.places[key]
+
+    def _pop(self):
+        if len(self.window) <= len(self.batch):   # the oldest mention is still in the unsent batch
+            self._flush()
+        loc_text, context, sentiment, location = self.window.popleft()
+        sentiment_label, confidence = sentiment.result()
+        _, coords = location.result()
+        latitude, longitude = coords.result()
+        return loc_text, latitude, longitude, context, sentiment_label, f"{confidence}%"
+
+# ---------------------------
+# 6. Main Workflow
+# ---------------------------
+def iter_mentions(sentences, locations_info):
+    """
+    Yields (LocationName, Context) for each location in book order, skipping
+    front/back-matter contexts and duplicate pairs.
+    """
+    processed_locations = set()   # (LocationName, Context) pairs already seen
+    for loc_text, start_char, end_char in locations_info:
+        context = get_context(sentences, start_char, end_char)
+
+        if any(keyword in context.lower() for keyword in ["chapter", "isbn", "ltd"]):
+            print(f"Skipping location extraction for {loc_text} due to ignored keywords in context.")
+            continue
+
+        # Skip duplicate LocationName and Context
+        if (loc_text, context) in processed_locations:
+            print(f"Skipping duplicate location: {loc_text} in context: {context}")
+            continue
+        processed_locations.add((loc_text, context))
+        yield loc_text, context
+
 def process_file(file_path):
-    extracted_text = extract_text(file_path)
-    doc = nlp(extracted_text)
-    
     # Extract locations using NER from spaCy, preserving the order as they appear in the book.
-    locations_info = []
-    for ent in doc.ents:
-        if ent.label_ in ["GPE", "LOC"]:
-            locations_info.append((ent.text, ent.start_char, ent.end_char))
+    sentences, locations_info = run_ner(extract_chapters(file_path))
     
     # Prepare output CSV file.
     output_dir = "/Users/daiyu/Documents/github_mac/colloquium3/csv_output"
@@ -170,46 +349,51 @@ def process_file(file_path):
         os.makedirs(output_dir)
     base_name = os.path.splitext(os.path.basename(file_path))[0]
     output_csv_file = os.path.join(output_dir, f"locations_{base_name}.csv")
-    
-    with open(output_csv_file, mode='w', newline='', encoding='utf-8') as csvfile:
+
+    def write(row):
+        loc_text, latitude, longitude, context, sentiment_label, confidence = row
+        csvwriter.writerow(row)
+        if latitude and longitude:
+            print(f"Geocoded {loc_text}: ({latitude}, {longitude}), Sentiment: {sentiment_label} (confidence: {confidence})")
+        else:
+            print(f"Could not geocode or did not meet criteria: {loc_text}, Sentiment: {sentiment_label} (confidence: {confidence})")
+
+    with open(output_csv_file, mode='w', newline='', encoding='utf-8') as csvfile, EnrichmentPipeline() as enrich:
         csvwriter = csv.writer(csvfile)
         csvwriter.writerow(["LocationName", "Latitude", "Longitude", "Context", "Sentiment", "Confidence"])
+        for loc_text, context in iter_mentions(sentences, locations_info):
+            for row in enrich.put(loc_text, context):
+                write(row)
+        for row in enrich.drain():
+            write(row)
+    print(f"Geocoded {enrich.mentions} mentions as {len(enrich.places)} canonical places")
 
-        # Initialize a set to track processed (LocationName, Context) pairs.
-        processed_locations = set()
-
-        # Iterate through the locations in the order they appear
-        for loc_text, start_char, end_char in locations_info:
-            context = get_context(doc, start_char, end_char)
-            
-            if any(keyword in context.lower() for keyword in ["chapter", "isbn", "ltd"]):
-                print(f"Skipping location extraction for {loc_text} due to ignored keywords in context.")
-                continue
-
-            # Skip duplicate LocationName and Context
-            if (loc_text, context) in processed_locations:
-                print(f"Skipping duplicate location: {loc_text} in context: {context}")
-                continue
-            processed_locations.add((loc_text, context))
-            
-            if isinstance(context, str):
-                accurate_location = analyze_location_with_gpt(context, loc_text)
-                latitude, longitude = get_coordinates_from_google_maps(accurate_location)
-                sentiment_label, confidence = analyze_emotion(context)
-                
-                if latitude and longitude:
-                    csvwriter.writerow([loc_text, latitude, longitude, context, sentiment_label, f"{confidence}%"])
-                    print(f"Geocoded {loc_text}: ({latitude}, {longitude}), Sentiment: {sentiment_label} (confidence: {confidence}%)")
-                else:
-                    csvwriter.writerow([loc_text, None, None, context, sentiment_label, f"{confidence}%"])
-                    print(f"Could not geocode or did not meet criteria: {loc_text}, Sentiment: {sentiment_label} (confidence: {confidence}%)")
-            else:
-                csvwriter.writerow([loc_text, None, None, context, "Unclear", ""])
-                print(f"Could not determine context for: {loc_text}")
-                
+    stats = geocode_cache().stats
+    print(f"Geocode cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
     return f"CSV file '{output_csv_file}' has been created."
 
+def setup():
+    """
+    Creates the API clients and loads the models.  Runs from main(), not at
+    import: spaCy's n_process workers re-import this module under the spawn
+    start method, and must not reload the model or re-check the API keys.
+    """
+    global gmaps, nlp, sia
+    google_maps_api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+    if not google_maps_api_key:
+        print("Google Maps API key not found. Please set the 'GOOGLE_MAPS_API_KEY' environment variable.")
+        sys.exit(1)
+    # A region name the boundary file does not know would reject every place.
+    if REGIONS_FILE and not load_regions(REGIONS_FILE).region_ids([GEOCODE_REGION]):
+        print(f"No region named '{GEOCODE_REGION}' in {REGIONS_FILE}. Please check 'GEOCODE_REGION'.")
+        sys.exit(1)
+    gmaps = googlemaps.Client(google_maps_api_key)
+    # Load the transformer-based spaCy model for English for improved NER.
+    nlp = spacy.load(SPACY_MODEL, exclude=["tagger", "attribute_ruler", "lemmatizer"])
+    sia = SentimentIntensityAnalyzer()
+
 def main():
+    setup()
     input_dir = "/Users/daiyu/Documents/github_mac/colloquium3/use_data"
     if not os.path.exists(input_dir):
         print(f"Input folder {input_dir} does not exist.")
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Offline Region Filter
+=====================
+Point-in-polygon tests against local boundary polygons (any Polygon /
+MultiPolygon GeoJSON, e.g. Natural Earth "Admin 0 – Countries"), so a region
+filter works the same for every geocoder, every cache entry and every GeoJSON
+file already on disk, with no provider response to inspect.
+
+Index
+-----
+Boundary edges are bucketed on a regular lon/lat grid (GRID_DEG cells).  For
+each cell and region the index keeps only the edges a point in that cell can
+cross with a ray towards +lon; a cell no edge touches is wholly inside or
+outside a region and is decided once.  Cells are built lazily, so loading a
+world file costs little more than parsing it.
+
+Regions are matched by any of their name / ISO properties, case-insensitive
+("US", "USA" and "United States of America" all name the same Natural Earth
+feature).  Points are ``(lon, lat)``, like the pipeline's coordinates.
+
+Usage
+-----
+  python regions.py filter book.geojson --regions countries.geojson --keep US -o us.geojson
+  python regions.py filter book.geojson --regions countries.geojson --drop CA --drop MX
+  python regions.py locate --regions countries.geojson -- -104.99,39.74 2.35,48.86
+  REGIONS_FILE=countries.geojson REGION_FILTER=US python pipeline.py my_book.txt
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from geojson_stream import FeatureWriter, read_features
+
+REGIONS_FILE   = os.getenv("REGIONS_FILE", "")    # boundary polygons GeoJSON
+REGION_FILTER  = os.getenv("REGION_FILTER", "")   # comma-separated regions to keep
+GRID_DEG       = 1.0                              # index cell size in degrees
+CROSSING_CELLS = 1 << 22                          # max points × edges per numpy step
+
+# Feature properties that may name a region (Natural Earth, GADM, geoBoundaries …)
+NAME_KEYS = ("NAME", "NAME_EN", "NAME_LONG", "ADMIN", "SOVEREIGNT", "ISO_A2", "ISO_A3",
+             "ADM0_A3", "name", "name_en", "iso_a2", "iso_a3", "shapeName", "shapeGroup")
+
+
+def _rings(geometry: dict) -> list[np.ndarray]:
+    """Every ring (exterior and holes) of a Polygon / MultiPolygon as [n, 2] arrays."""
+    kind, coords = geometry.get("type"), geometry.get("coordinates") or []
+    polygons = [coords] if kind == "Polygon" else coords if kind == "MultiPolygon" else []
+    return [np.asarray(ring, dtype=np.float64)[:, :2] for polygon in polygons
+            for ring in polygon if len(ring) >= 3]
+
+
+class RegionIndex:
+    """Grid spatial index over region boundaries."""
+
+    def __init__(self, regions: list[tuple[str, set[str], list[np.ndarray]]],
+                 cell_deg: float = GRID_DEG):
+        self.cell    = cell_deg
+        self.names   = [name for name, _, _ in regions]
+        self.aliases = [{a.casefold() for a in aliases} | {name.casefold()}
+                        for name, aliases, _ in regions]
+        edges = []
+        for _, _, rings in regions:
+            # Even–odd over all rings of a region handles holes and multipart shapes.
+            segs = [np.hstack([ring, np.roll(ring, -1, axis=0)]) for ring in rings]
+            edges.append(np.vstack(segs) if segs else np.zeros((0, 4)))
+        self.edges = edges                        # per region: [n, 4] x1 y1 x2 y2
+        self.spans = [(np.minimum(e[:, 0], e[:, 2]), np.maximum(e[:, 0], e[:, 2]),
+                       np.minimum(e[:, 1], e[:, 3]), np.maximum(e[:, 1], e[:, 3]))
+                      for e in edges]                # per-edge lon / lat extent
+        self.bbox  = np.array([[e[:, [0, 2]].min(), e[:, [1, 3]].min(),
+                                e[:, [0, 2]].max(), e[:, [1, 3]].max()] if len(e)
+                               else [np.inf, np.inf, -np.inf, -np.inf] for e in edges])
+        self._cells: dict[tuple[int, int], list] = {}
+
+    @classmethod
+    def from_geojson(cls, path: str | Path, cell_deg: float = GRID_DEG) -> "RegionIndex":
+        regions = []
+        for i, feature in enumerate(read_features(path)):
+            props = feature.get("properties") or {}
+            rings = _rings(feature.get("geometry") or {})
+            if not rings:
+                continue
+            aliases = {str(props[k]) for k in NAME_KEYS if props.get(k) not in (None, "", "-99")}
+            name    = next((str(props[k]) for k in NAME_KEYS if props.get(k)), f"region {i}")
+            regions.append((name, aliases, rings))
+        return cls(regions, cell_deg)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    # ── cells ────────────────────────────────────────────────────────────────
+
+    def _cell(self, cx: int, cy: int) -> list:
+        """
+        [(region, edges)] for the regions that may contain points of cell
+        (cx, cy); ``edges`` is None when the region covers the whole cell.
+        """
+        key = (cx, cy)
+        if key in self._cells:
+            return self._cells[key]
+        x0, y0 = cx * self.cell, cy * self.cell
+        x1, y1 = x0 + self.cell, y0 + self.cell
+        b = self.bbox
+        entries = []
+        for r in np.nonzero((b[:, 0] <= x1) & (b[:, 2] >= x0) &
+                            (b[:, 1] <= y1) & (b[:, 3] >= y0))[0]:
+            e = self.edges[r]
+            ex0, ex1, ey0, ey1 = self.spans[r]
+            band = (ey1 >= y0) & (ey0 <= y1) & (ex1 >= x0)   # crossable by a +lon ray
+            if not (band & (ex0 <= x1)).any():
+                # No edge touches the cell: it is entirely inside or outside.
+                centre = np.array([[x0 + self.cell / 2, y0 + self.cell / 2]])
+                if _crossings(centre, e[band])[0]:
+                    entries.append((r, None))
+            else:
+                entries.append((r, e[band]))
+        self._cells[key] = entries
+        return entries
+
+    # ── queries ──────────────────────────────────────────────────────────────
+
+    def locate(self, points) -> list[str | None]:
+        """Region name containing each ``(lon, lat)`` point (None: none / no coords)."""
+        ids = self.locate_ids(points)
+        return [self.names[i] if i >= 0 else None for i in ids]
+
+    def locate_ids(self, points, among: set[int] | None = None) -> np.ndarray:
+        """
+        Region index containing each point, -1 where none.  With ``among``
+        only those regions are tested, so a point inside one of them is found
+        even when it also lies in another (nested or overlapping) region.
+        """
+        points = list(points)
+        out    = np.full(len(points), -1, dtype=np.int64)
+        valid  = [i for i, p in enumerate(points) if p is not None
+                  and all(math.isfinite(v) for v in p[:2])]
+        if not valid:
+            return out
+        pts   = np.array([points[i][:2] for i in valid], dtype=np.float64)
+        cells = np.floor(pts / self.cell).astype(np.int64)
+        keys, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+        groups  = np.split(np.argsort(inverse.reshape(-1), kind="stable"), np.cumsum(counts)[:-1])
+        valid   = np.asarray(valid)
+        for (cx, cy), members in zip(keys, groups):
+            found = np.full(len(members), -1, dtype=np.int64)
+            for region, edges in self._cell(int(cx), int(cy)):
+                if among is not None and region not in among:
+                    continue
+                open_ = found < 0
+                if not open_.any():
+                    break
+                if edges is None:
+                    hit = open_
+                else:
+                    hit = np.zeros_like(open_)
+                    hit[open_] = _crossings(pts[members[open_]], edges)
+                found[hit] = region
+            out[valid[members]] = found
+        return out
+
+    def region_ids(self, names) -> set[int]:
+        """Indices of the regions matching any of ``names`` (name or ISO code)."""
+        wanted = {n.strip().casefold() for n in names if n.strip()}
+        return {i for i, aliases in enumerate(self.aliases) if aliases & wanted}
+
+    def contains(self, points, names) -> np.ndarray:
+        """Boolean mask: which ``(lon, lat)`` points fall in any of the ``names`` regions."""
+        return self.locate_ids(points, self.region_ids(names)) >= 0
+
+
+def _crossings(pts: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Even–odd test: True where a +lon ray from each point crosses ``edges`` oddly."""
+    out = np.zeros(len(pts), dtype=bool)
+    if not len(edges):
+        return out
+    x1, y1, x2, y2 = (edges[:, i] for i in range(4))
+    step = max(1, CROSSING_CELLS // len(edges))   # bound the points × edges matrix
+    for i in range(0, len(pts), step):
+        px, py = pts[i:i + step, :1], pts[i:i + step, 1:2]
+        spans = (y1 > py) != (y2 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_at = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        out[i:i + step] = (spans & (px < x_at)).sum(axis=1) % 2 == 1
+    return out
+
+
+@lru_cache(maxsize=4)
+def load_regions(path: str) -> RegionIndex:
+    """Region index for a boundary file, loaded once per process."""
+    return RegionIndex.from_geojson(path)
+
+
+def region_filter() -> tuple[RegionIndex, list[str]] | None:
+    """
+    (index, region names) from REGIONS_FILE / REGION_FILTER, or None if unset.
+    Raises ValueError for a name the boundary file does not know — it would
+    otherwise silently drop every place.
+    """
+    names = [n.strip() for n in REGION_FILTER.split(",") if n.strip()]
+    if not (REGIONS_FILE and names):
+        return None
+    index = load_regions(REGIONS_FILE)
+    unknown = [name for name in names if not index.region_ids([name])]
+    if unknown:
+        raise ValueError(f"No region named {', '.join(map(repr, unknown))} in {REGIONS_FILE} "
+                         f"(REGION_FILTER)")
+    return index, names
+
+
+def _point(feature: dict) -> tuple[float, float] | None:
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") != "Point" or len(geometry.get("coordinates") or ()) < 2:
+        return None
+    return tuple(geometry["coordinates"][:2])
+
+
+def filter_features(features: list[dict], index: RegionIndex,
+                    keep: list[str] | None = None, drop: list[str] | None = None) -> list[dict]:
+    """Point features inside any ``keep`` region (default: any) and no ``drop`` region."""
+    points = [_point(f) for f in features]
+    ok = index.contains(points, keep) if keep else index.locate_ids(points) >= 0
+    if drop:
+        ok &= ~index.contains(points, drop)
+    return [f for f, flag in zip(features, ok) if flag]
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def _parse_point(spec: str) -> tuple[float, float]:
+    try:
+        lon, lat = (float(v) for v in spec.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected LON,LAT, got {spec!r}")
+    return lon, lat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline point-in-polygon region filter")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    f = sub.add_parser("filter", help="Keep / drop the features of a GeoJSON by region")
+    f.add_argument("input",              help="GeoJSON / ndjson of point features")
+    f.add_argument("--regions", "-r",    default=REGIONS_FILE or None, required=not REGIONS_FILE,
+                   help="Boundary polygons GeoJSON (default: $REGIONS_FILE)")
+    f.add_argument("--keep",             action="append", default=[],
+                   help="Region name or ISO code to keep (repeatable; default: any region)")
+    f.add_argument("--drop",             action="append", default=[],
+                   help="Region name or ISO code to drop (repeatable)")
+    f.add_argument("--out", "-o",        help="Output file (default: overwrite input)")
+
+    q = sub.add_parser("locate", help="Print the region of LON,LAT points")
+    q.add_argument("points",             nargs="+", type=_parse_point)
+    q.add_argument("--regions", "-r",    default=REGIONS_FILE or None, required=not REGIONS_FILE,
+                   help="Boundary polygons GeoJSON (default: $REGIONS_FILE)")
+    args = parser.parse_args()
+
+    t0    = time.perf_counter()
+    index = load_regions(args.regions)
+    print(f"  {len(index)} region(s) loaded from {args.regions} ({time.perf_counter() - t0:.2f}s)")
+
+    if args.cmd == "locate":
+        for point, name in zip(args.points, index.locate(args.points)):
+            print(f"{point[0]:.4f},{point[1]:.4f}: {name or '—'}")
+        sys.exit(0)
+
+    for name in args.keep + args.drop:
+        if not index.region_ids([name]):
+            print(f"Error: no region named {name!r} in {args.regions}")
+            sys.exit(1)
+    input_path  = Path(args.input)
+    features    = list(read_features(input_path))
+    t0          = time.perf_counter()
+    kept        = filter_features(features, index, args.keep, args.drop)
+    output_path = Path(args.out) if args.out else input_path
+    with FeatureWriter(output_path) as writer:
+        writer.write_all(kept)
+    print(f"✓  {len(kept)}/{len(features)} features kept → {output_path} "
+          f"({time.perf_counter() - t0:.2f}s)")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Re-threshold an existing pipeline output
+========================================
+``pipeline.py`` writes the raw BGE-M3 similarity scores for every feature to a
+sidecar next to the GeoJSON (``<out>.scores.npz``).  This tool re-applies new
+global or per-label thresholds to those scores in one vectorized pass and
+rewrites the ``topics`` / ``themes`` booleans — no models are loaded.
+
+Sidecar contents
+----------------
+  topic_scores   float32 (n_features, n_topics)
+  theme_scores   float32 (n_features, n_themes)
+  topic_keys     str     label order of topic_scores columns
+  theme_keys     str     label order of theme_scores columns
+  thresholds     float32 default [topic, theme] thresholds for this file
+  label_keys     str     labels with their own threshold (optional)
+  label_thresholds float32 threshold of each of label_keys
+
+The thresholds actually applied are always written back to the output's
+sidecar, so runs compose: per-label overrides stay in force until a later
+``--label`` replaces them.
+
+Usage
+-----
+  python rethreshold.py book.geojson --topic 0.40 --theme 0.30
+  python rethreshold.py book.geojson --label river=0.45 --label risk=0.28 -o tuned.geojson
+  python rethreshold.py book.geojson --stats            # label counts only
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from geojson_stream import FeatureWriter, read_features
+
+
+def scores_path_for(geojson_path: str | Path) -> Path:
+    p = Path(geojson_path)
+    return p.with_name(p.stem + ".scores.npz")
+
+
+def save_scores(path: str | Path, topic_scores: np.ndarray, theme_scores: np.ndarray,
+                topic_keys: list[str], theme_keys: list[str],
+                topic_threshold: float, theme_threshold: float,
+                label_thresholds: dict[str, float] | None = None) -> None:
+    labels = label_thresholds or {}
+    np.savez_compressed(
+        path,
+        topic_scores=np.asarray(topic_scores, dtype=np.float32),
+        theme_scores=np.asarray(theme_scores, dtype=np.float32),
+        topic_keys=np.array(topic_keys),
+        theme_keys=np.array(theme_keys),
+        thresholds=np.array([topic_threshold, theme_threshold], dtype=np.float32),
+        label_keys=np.array(list(labels), dtype=str),
+        label_thresholds=np.array(list(labels.values()), dtype=np.float32),
+    )
+
+
+def load_scores(path: str | Path) -> dict:
+    with np.load(path) as z:
+        return {k: z[k] for k in z.files}
+
+
+def effective_thresholds(scores: dict, topic: float | None = None,
+                         theme: float | None = None,
+                         per_label: dict[str, float] | None = None) -> tuple[float, float, dict]:
+    """(topic, theme, per-label) thresholds: the sidecar's, updated by the given ones."""
+    default_topic, default_theme = (float(x) for x in scores["thresholds"])
+    labels = {str(k): float(v) for k, v in zip(scores.get("label_keys", ()),
+                                               scores.get("label_thresholds", ()))}
+    labels.update(per_label or {})
+    return (default_topic if topic is None else topic,
+            default_theme if theme is None else theme, labels)
+
+
+def threshold_vector(keys: list[str], default: float, overrides: dict[str, float]) -> np.ndarray:
+    t = np.full(len(keys), default, dtype=np.float32)
+    for i, k in enumerate(keys):
+        if k in overrides:
+            t[i] = overrides[k]
+    return t
+
+
+def apply_thresholds(geojson: dict, scores: dict, topic: float | None = None,
+                     theme: float | None = None,
+                     per_label: dict[str, float] | None = None) -> dict:
+    """Rewrite topics/themes of every feature in place; returns ``geojson``."""
+    features = geojson["features"]
+    if len(features) != len(scores["topic_scores"]):
+        raise ValueError(f"{len(features)} features but {len(scores['topic_scores'])} "
+                         "score rows — sidecar does not belong to this file")
+    topic_keys = [str(k) for k in scores["topic_keys"]]
+    theme_keys = [str(k) for k in scores["theme_keys"]]
+    unknown = set(per_label or {}) - set(topic_keys) - set(theme_keys)
+    if unknown:
+        raise ValueError(f"Unknown label(s): {', '.join(sorted(unknown))}")
+    topic, theme, per_label = effective_thresholds(scores, topic, theme, per_label)
+
+    topic_tab = scores["topic_scores"] >= threshold_vector(topic_keys, topic, per_label)
+    theme_tab = scores["theme_scores"] >= threshold_vector(theme_keys, theme, per_label)
+
+    topic_rows = topic_tab.tolist()
+    theme_rows = theme_tab.tolist()
+    for feat, t_row, h_row in zip(features, topic_rows, theme_rows):
+        props = feat["properties"]
+        props["topics"] = dict(zip(topic_keys, t_row))
+        props["themes"] = dict(zip(theme_keys, h_row))
+    return geojson
+
+
+def _parse_label(spec: str) -> tuple[str, float]:
+    name, _, value = spec.partition("=")
+    try:
+        return name.strip(), float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected LABEL=THRESHOLD, got {spec!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-apply topic/theme thresholds to a pipeline output"
+    )
+    parser.add_argument("input",            help="GeoJSON / ndjson written by pipeline.py")
+    parser.add_argument("--scores",         help="Score sidecar (default: <input>.scores.npz)")
+    parser.add_argument("--topic",          type=float, help="Global topic threshold")
+    parser.add_argument("--theme",          type=float, help="Global theme threshold")
+    parser.add_argument("--label",          type=_parse_label, action="append", default=[],
+                        metavar="LABEL=T",  help="Per-label threshold (repeatable)")
+    parser.add_argument("--out", "-o",      help="Output GeoJSON (default: overwrite input)")
+    parser.add_argument("--stats",          action="store_true",
+                        help="Only print how many features each label would get")
+    args = parser.parse_args()
+
+    input_path  = Path(args.input)
+    scores_path = Path(args.scores) if args.scores else scores_path_for(input_path)
+    if not scores_path.exists():
+        print(f"Error: score sidecar {scores_path} not found")
+        sys.exit(1)
+
+    geojson = {"type": "FeatureCollection", "features": list(read_features(input_path))}
+    scores  = load_scores(scores_path)
+    try:
+        apply_thresholds(geojson, scores, args.topic, args.theme, dict(args.label))
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.stats:
+        for group in ("topics", "themes"):
+            counts: dict[str, int] = {}
+            for feat in geojson["features"]:
+                for k, v in feat["properties"][group].items():
+                    counts[k] = counts.get(k, 0) + int(v)
+            print(f"{group}:")
+            for k, n in counts.items():
+                print(f"  {k:<34} {n:>6}")
+        sys.exit(0)
+
+    output_path = Path(args.out) if args.out else input_path
+    with FeatureWriter(output_path) as writer:
+        writer.write_all(geojson["features"])
+    topic_t, theme_t, labels = effective_thresholds(scores, args.topic, args.theme,
+                                                    dict(args.label))
+    save_scores(scores_path_for(output_path), scores["topic_scores"], scores["theme_scores"],
+                list(scores["topic_keys"]), list(scores["theme_keys"]),
+                topic_t, theme_t, labels)
+    print(f"✓  {len(geojson['features'])} features re-thresholded → {output_path}")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the Mapbox geocoding stage against a stub forward-geocoding
+server (stdlib http.server on 127.0.0.1 — no token, no network):
+
+  ① 429 / 5xx replies are retried, honouring Retry-After
+  ② other 4xx replies are not retried, and errors are not cached
+  ③ an empty ``features`` list is cached as a negative answer
+  ④ geocode_all keeps input order under concurrency and queries duplicates once
+
+Run: python test_geocoding_stub.py   (or: python -m pytest test_geocoding_stub.py)
+"""
+
+import json
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+import cache
+from geocoding import MapboxGeocoder
+
+# =============================================================================
+# STUB SERVER
+# =============================================================================
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)["q"][0]
+        with self.server.lock:
+            self.server.queries.append(query)
+        status, body, headers = self.server.reply(query)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@contextmanager
+def stub_mapbox(reply):
+    """
+    Serve ``reply(query) -> (status, json body, headers)`` with a fresh,
+    temporary geocode cache; yields (server, geocoder factory).
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.reply, server.queries, server.lock = reply, [], threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}/search/geocode/v6/forward"
+
+    def geocoder(**options):
+        return MapboxGeocoder(token="stub", url=url, rate=0, **options)
+
+    saved = cache._geocache
+    with tempfile.TemporaryDirectory() as tmp:
+        cache._geocache = cache.DiskCache(Path(tmp) / "geocode.sqlite", table="geocode")
+        try:
+            yield server, geocoder
+        finally:
+            cache._geocache = saved
+            server.shutdown()
+            server.server_close()
+
+
+def _point(lon: float, lat: float) -> dict:
+    return {"features": [{"geometry": {"type": "Point", "coordinates": [lon, lat]}}]}
+
+# =============================================================================
+# TESTS
+# =============================================================================
+
+def test_retry_on_429_and_5xx():
+    replies = iter([(503, {}, {}), (429, {}, {"Retry-After": "0.5"}),
+                    (200, _point(-71.34, 42.44), {})])
+    with stub_mapbox(lambda q: next(replies)) as (server, geocoder):
+        t0 = time.perf_counter()
+        # Backoff alone would wait 0.05 + 0.1 s; Retry-After stretches the second wait.
+        coords = geocoder(backoff=0.05).lookup("Concord")
+        elapsed = time.perf_counter() - t0
+    assert coords == (-71.34, 42.44)
+    assert server.queries == ["Concord"] * 3
+    assert 0.55 <= elapsed < 1.5, f"Retry-After not honoured ({elapsed:.2f}s)"
+
+    with stub_mapbox(lambda q: (429, {}, {"Retry-After": "0"})) as (server, geocoder):
+        try:
+            geocoder(retries=2).lookup("Concord")
+        except requests.HTTPError as e:
+            assert e.response.status_code == 429
+        else:
+            raise AssertionError("exhausted retries did not raise")
+    assert len(server.queries) == 3   # 1 try + 2 retries, then give up
+
+
+def test_no_retry_on_4xx():
+    with stub_mapbox(lambda q: (401, {"message": "Not Authorized"}, {})) as (server, geocoder):
+        g = geocoder(backoff=0.01)
+        try:
+            g.lookup("Concord")
+        except requests.HTTPError as e:
+            assert e.response.status_code == 401
+        else:
+            raise AssertionError("HTTP 401 did not raise")
+        assert len(server.queries) == 1
+        assert g.geocode("Concord") is None   # reported, not raised …
+        assert g.geocode("Concord") is None
+        assert len(server.queries) == 3       # … and not cached
+
+
+def test_negative_cache():
+    with stub_mapbox(lambda q: (200, {"features": []}, {})) as (server, geocoder):
+        g = geocoder()
+        assert g.geocode("Nowhere-on-Sea") is None
+        assert g.geocode("nowhere-on-sea") is None   # same normalized query
+        assert server.queries == ["Nowhere-on-Sea"]
+        assert cache.geocode_cache().negative_hits == 1
+
+
+def test_geocode_all_order():
+    places = {f"Town {i}": (-100.0 + i, 30.0 + i / 10) for i in range(40)}
+
+    def reply(query):
+        i = int(query.split()[-1])
+        time.sleep(0.001 * ((i * 7) % 5))   # answer out of order
+        return 200, _point(*places[query]), {}
+
+    names = list(places) + ["town 3", "TOWN 17"]   # duplicates after normalization
+    with stub_mapbox(reply) as (server, geocoder):
+        results = geocoder(workers=8).geocode_all(names)
+    assert results == [places[n] for n in places] + [places["Town 3"], places["Town 17"]]
+    assert sorted(server.queries) == sorted(places)   # each distinct query once
+
+
+if __name__ == "__main__":
+    tests = [test_retry_on_429_and_5xx, test_no_retry_on_4xx, test_negative_cache,
+             test_geocode_all_order]
+    for test in tests:
+        test()
+        print(f"   ✓  {test.__name__}")
+    print(f"\n  {len(tests)} test(s) passed\n")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Offline tests for the LLM client against a stub chat-completions server
+(stdlib http.server on 127.0.0.1 — no model, no API key, no network):
+
+  ① SSE streaming stops as soon as the reply's JSON array closes
+  ② 429 / 5xx replies are retried, other errors are not
+  ③ imap_ordered keeps input order and a bounded window
+  ④ GPT disambiguation batches requests and serves repeats from the cache
+
+Run: python test_llm_stub.py   (or: python -m pytest test_llm_stub.py)
+"""
+
+import json
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+import cache
+import disambiguate
+from jsonstream import ArrayScanner
+from llm import OpenAIBackend, imap_ordered
+
+# =============================================================================
+# STUB SERVER
+# =============================================================================
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.bodies.append(body)
+        status, reply = self.server.reply(body)
+        if isinstance(reply, list):   # SSE: one delta per item, 10 ms apart
+            self.send_response(status)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            try:
+                for piece in reply:
+                    event = {"choices": [{"delta": {"content": piece}}]}
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(0.01)
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+        data = json.dumps({"choices": [{"message": {"content": reply}}]} if status == 200
+                          else {"error": reply}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@contextmanager
+def stub_server(reply):
+    """Serve ``reply(request_body) -> (status, content | [SSE deltas])``."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.reply, server.bodies, server.lock = reply, [], threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server, f"http://127.0.0.1:{server.server_port}/v1"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _user_prompt(body: dict) -> str:
+    return body["messages"][-1]["content"]
+
+# =============================================================================
+# TESTS
+# =============================================================================
+
+def test_sse_early_stop():
+    pieces = ['Sure: [{"name": ', '"Walden Pond"}', "]"] + [" and more"] * 200
+    with stub_server(lambda body: (200, pieces)) as (server, url):
+        backend = OpenAIBackend("stub", url=url, stream=True)
+        usage   = {}
+        t0      = time.perf_counter()
+        reply   = backend.generate([{"role": "user", "content": "hi"}], 500, {},
+                                   usage=usage, stop=ArrayScanner().feed)
+        elapsed = time.perf_counter() - t0
+    assert reply == 'Sure: [{"name": "Walden Pond"}]'
+    assert usage["stopped"] and usage["completion_tokens"] == 3
+    assert elapsed < 1.0, f"stream not cut short ({elapsed:.2f}s)"   # full reply ≈ 2 s
+    assert server.bodies[0]["stream"] is True
+
+
+def test_retry_on_429_and_5xx():
+    statuses = iter([429, 503, 200])
+    with stub_server(lambda body: (next(statuses), "[]")) as (server, url):
+        backend = OpenAIBackend("stub", url=url, stream=False, backoff=0.01)
+        assert backend.generate([{"role": "user", "content": "hi"}], 10, {}) == "[]"
+    assert len(server.bodies) == 3
+
+    with stub_server(lambda body: (400, "bad request")) as (server, url):
+        backend = OpenAIBackend("stub", url=url, stream=False, backoff=0.01)
+        try:
+            backend.generate([{"role": "user", "content": "hi"}], 10, {})
+        except requests.HTTPError as e:
+            assert e.response.status_code == 400
+        else:
+            raise AssertionError("HTTP 400 did not raise")
+    assert len(server.bodies) == 1   # client errors are not retried
+
+
+def test_imap_ordered():
+    depth, lock = 4, threading.Lock()
+    state = {"pulled": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def items():
+        for i in range(40):
+            state["pulled"] += 1
+            yield i
+
+    def work(i):
+        with lock:
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        time.sleep(0.001 * ((i * 7) % 5))   # finish out of order
+        with lock:
+            state["in_flight"] -= 1
+        return i * i
+
+    results = []
+    for item, result in imap_ordered(work, items(), depth):
+        if not results:
+            assert state["pulled"] <= depth   # lazy: only the first window pulled
+        results.append((item, result))
+    assert results == [(i, i * i) for i in range(40)]
+    assert state["max_in_flight"] <= depth
+
+
+def test_disambiguation_batches_and_cache():
+    def reply(body):
+        prompt   = _user_prompt(body)
+        mentions = json.loads(prompt.split("MENTIONS:\n", 1)[1].split("\n\nReturn", 1)[0])
+        return 200, json.dumps([{"id": m["id"], "location": m["name"] + ", USA"}
+                                for m in mentions])
+
+    mentions = [("Concord", "lived near Concord"), ("Boston", "walked to Boston"),
+                ("Concord", "lived near Concord"), ("Salem", "sailed from Salem"),
+                ("Boston", "the Boston road"), ("Lincoln", "the Lincoln woods")]
+    with tempfile.TemporaryDirectory() as tmp, stub_server(reply) as (server, url), \
+            _patched(cache, _llm_cache=cache.DiskCache(Path(tmp) / "llm.sqlite", table="llm")), \
+            _patched(disambiguate, GPT_BATCH_SIZE=2,
+                     _gpt=OpenAIBackend("stub", url=url, stream=False, backoff=0.01)):
+        first = disambiguate.analyze_locations_with_gpt(mentions)
+        assert first == [name + ", USA" for name, _ in mentions]
+        assert len(server.bodies) == 3   # 5 distinct mentions, 2 per request
+
+        again = disambiguate.analyze_locations_with_gpt(mentions)
+        assert again == first and len(server.bodies) == 3   # all from the cache
+        assert cache.llm_cache().hits >= len(mentions)
+
+        more = disambiguate.analyze_locations_with_gpt(mentions + [("Walden", "at Walden")])
+        assert more[-1] == "Walden, USA" and len(server.bodies) == 4
+
+
+@contextmanager
+def _patched(module, **values):
+    saved = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+if __name__ == "__main__":
+    tests = [test_sse_early_stop, test_retry_on_429_and_5xx, test_imap_ordered,
+             test_disambiguation_batches_and_cache]
+    for test in tests:
+        test()
+        print(f"   ✓  {test.__name__}")
+    print(f"\n  {len(tests)} test(s) passed\n")